@@ -0,0 +1,60 @@
+"""CPU seconds and wall time per track: stream copy vs mp3 transcode.
+
+Run from the repository root:
+
+    python benchmarks/cache_modes.py [source]
+
+source is a stream url or a local audio file. Without it a 4 minute AAC
+test tone is generated with ffmpeg, which stands in for an HLS AAC
+transcoding served by SoundCloud.
+"""
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import downloader  # noqa: E402
+from cache import AudioCache  # noqa: E402
+
+RUNS = 3
+
+
+def children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(source: str, cache: AudioCache, mode: str, track_id: str):
+    cpu, wall = children_cpu(), perf_counter()
+    path = downloader.download_to_cache(source, track_id, "Benchmark", "benchmarks", cache, mode=mode)
+    return children_cpu() - cpu, perf_counter() - wall, path.stat().st_size
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        # A throwaway cache, the real one under ~/.soundcloud stays untouched
+        cache = AudioCache(Path(tmp) / "cache")
+        if len(sys.argv) > 1:
+            source = sys.argv[1]
+        else:
+            source = str(Path(tmp) / "source.m4a")
+            subprocess.run(
+                ["ffmpeg", "-loglevel", "quiet", "-f", "lavfi", "-i", "sine=frequency=440:duration=240",
+                 "-c:a", "aac", "-b:a", "160k", source],
+                check=True,
+            )
+
+        for mode in ("mp3", "copy"):
+            results = [measure(source, cache, mode, f"{mode}{i}") for i in range(RUNS)]
+            cpu = min(r[0] for r in results)
+            wall = min(r[1] for r in results)
+            size = results[0][2]
+            print(f"{mode:>4}: cpu {cpu:6.2f}s  wall {wall:6.2f}s  {size / 1024:8.0f} KiB (best of {RUNS})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Active lyric line lookup: linear nearest-start scan vs sorted timeline.
+
+Run from the repository root: python benchmarks/karaoke_lookup.py
+"""
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from karaoke import LyricTimeline  # noqa: E402
+
+#: Lines of the synthetic lyrics, a long DJ mix
+LINES = 1000
+TICKS = 10_000
+
+
+def linear(karaoke: dict, pos_time: int):
+    # What position_change did every tick
+    pos = min(karaoke, key=lambda x: abs(x - pos_time))
+    return karaoke[pos] if pos - pos_time < 100 else None
+
+
+def main():
+    random.seed(0)
+    starts = sorted(random.sample(range(0, LINES * 4000), LINES))
+    karaoke = {start: j for j, start in enumerate(starts)}
+    timeline = LyricTimeline((start, f"line {j}") for j, start in enumerate(starts))
+    positions = [random.randrange(0, starts[-1] + 4000) for _ in range(TICKS)]
+
+    scan = timeit.timeit(lambda: [linear(karaoke, p) for p in positions], number=1)
+    search = timeit.timeit(lambda: [timeline.line_at(p) for p in positions], number=1)
+
+    print(f"{LINES} lines, {TICKS} lookups")
+    print(f"linear scan: {scan / TICKS * 1e6:8.2f} us/lookup")
+    print(f"bisect     : {search / TICKS * 1e6:8.2f} us/lookup ({scan / search:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""CPU cost of following the player at idle playback: playerctl processes vs D-Bus.
+
+Starts a private session bus with a stub MPRIS player, then polls it the way
+position_change did (length, position and status every 100 ms) with both
+backends, and finally just listens to the player events. Needs dbus-daemon;
+the process backend also needs playerctl.
+
+Run from the repository root: python benchmarks/playerctl_cpu.py
+"""
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from time import perf_counter, sleep
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from playerctl import PlayerCtl, MPRIS_NAME, MPRIS_PATH, PLAYER_INTERFACE  # noqa: E402
+
+SECONDS = 10
+INTERVAL = 0.1
+#: Track of the stub player, in µs
+STUB_LENGTH = 180_000_000
+
+
+def stub_player(length: int = STUB_LENGTH):
+    """Minimal MPRIS player with one track of length µs, stopped until Play, Stopped at its end"""
+    from jeepney import DBusAddress, HeaderFields, MessageType, new_error, new_method_return, new_signal
+    from jeepney.bus_messages import message_bus
+    from jeepney.io.blocking import open_dbus_connection
+
+    connection = open_dbus_connection(bus="SESSION")
+    connection.send_and_get_reply(message_bus.RequestName(MPRIS_NAME))
+    emitter = DBusAddress(MPRIS_PATH, interface="org.freedesktop.DBus.Properties")
+    track_id = "/org/videolan/vlc/playlist/1"
+    metadata = {"mpris:trackid": ("o", track_id), "mpris:length": ("x", length)}
+    status = "Stopped"
+    # Position in µs when playback last started or jumped
+    offset, started = 0, None
+
+    def position() -> int:
+        if status != "Playing":
+            return offset
+        return min(length, offset + int((perf_counter() - started) * 1_000_000))
+
+    def change(new_status: str):
+        nonlocal status
+        status = new_status
+        changed = (PLAYER_INTERFACE, {"PlaybackStatus": ("s", status)}, [])
+        connection.send(new_signal(emitter, "PropertiesChanged", "sa{sv}as", changed))
+
+    while True:
+        timeout = None
+        if status == "Playing":
+            timeout = max(0.0, (length - position()) / 1_000_000)
+        try:
+            message = connection.receive(timeout=timeout)
+        except TimeoutError:
+            # Track over, like VLC with its single item
+            offset = 0
+            change("Stopped")
+            continue
+        if message.header.message_type != MessageType.method_call:
+            continue
+        member = message.header.fields.get(HeaderFields.member)
+        if member == "Play" and status != "Playing":
+            started = perf_counter()
+            change("Playing")
+        elif member == "Pause" and status == "Playing":
+            offset = position()
+            change("Paused")
+        elif member == "SetPosition":
+            # MPRIS ignores a stale track id or a position past the end
+            target_id, target = message.body
+            if target_id == track_id and 0 <= target <= length:
+                offset, started = target, perf_counter()
+        if member == "Get":
+            properties = {
+                "PlaybackStatus": ("s", status),
+                "Position": ("x", position()),
+                "Metadata": ("a{sv}", metadata),
+            }
+            name = message.body[1]
+            if name in properties:
+                connection.send(new_method_return(message, "v", (properties[name],)))
+            else:
+                connection.send(new_error(message, "org.freedesktop.DBus.Error.UnknownProperty"))
+        else:
+            connection.send(new_method_return(message))
+
+
+def start_bus():
+    daemon = subprocess.Popen(
+        ["dbus-daemon", "--session", "--nofork", "--print-address"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    os.environ["DBUS_SESSION_BUS_ADDRESS"] = daemon.stdout.readline().strip()
+    return daemon
+
+
+def cpu_time() -> float:
+    """CPU seconds of this process and its finished children"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def playerctl(*args) -> str:
+    # What every getter of the old backend did
+    process = subprocess.Popen(" ".join(("playerctl",) + args), shell=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out = process.stdout.read()
+    process.wait()
+    return out.decode().strip()
+
+
+def poll_processes():
+    playerctl("metadata", "--format", '"{{ mpris:length }}"')
+    # get_position() asked for the length once more before the position
+    playerctl("metadata", "--format", '"{{ mpris:length }}"')
+    playerctl("position")
+    playerctl("status")
+
+
+def poll_dbus(player):
+    player.get_length()
+    player.get_position()
+    player.get_status()
+
+
+def listen(player, ticks: list):
+    # The position events replace the polling, nothing else runs while idle
+    player.subscribe(lambda event, value: ticks.append(value) if event == "position" else None)
+    sleep(SECONDS)
+
+
+def measure(poll, *args) -> float:
+    """CPU share (%) of one core spent polling for SECONDS"""
+    start = cpu_time()
+    for _ in range(int(SECONDS / INTERVAL)):
+        poll(*args)
+        sleep(INTERVAL)
+    return (cpu_time() - start) / SECONDS * 100
+
+
+def main():
+    daemon = start_bus()
+    player = None
+    try:
+        player = PlayerCtl(command=f"{sys.executable} {Path(__file__).resolve()} --stub")
+        if player.wait_ready():
+            print(f"stub player ready in {player.ready_latency * 1000:.0f} ms")
+        player.set_media("file:///dev/null")
+        player.play()
+        if shutil.which("playerctl"):
+            print(f"playerctl processes: {measure(poll_processes):6.2f}% CPU")
+        else:
+            print("playerctl processes: skipped, playerctl is not installed")
+        print(f"MPRIS over D-Bus   : {measure(poll_dbus, player):6.2f}% CPU")
+        print(f"({SECONDS}s of polling every {INTERVAL * 1000:.0f} ms, idle stub player on a private bus)")
+
+        ticks = []
+        start = cpu_time()
+        listen(player, ticks)
+        usage = (cpu_time() - start) / SECONDS * 100
+        print(f"player events      : {usage:6.2f}% CPU ({len(ticks)} position events in {SECONDS}s)")
+    finally:
+        if player is not None:
+            player.inst.terminate()
+            player.close()
+        daemon.terminate()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--stub"]:
+        stub_player(*map(int, sys.argv[2:3]))
+    else:
+        main()
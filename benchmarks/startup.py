@@ -0,0 +1,41 @@
+"""Startup time of Soundcloud() before/after the cached bootstrap.
+
+Run from the repository root: python benchmarks/startup.py
+"""
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from soundcloud import Soundcloud  # noqa: E402
+
+CLIENT_ID = "AsIBxSC4kw4QXdGp0vufY0YztIlkRMUc"
+RUNS = 5
+
+
+def measure(**kwargs) -> float:
+    start = perf_counter()
+    client = Soundcloud("", CLIENT_ID, **kwargs)
+    elapsed = perf_counter() - start
+    client.close()
+    return elapsed
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        # Before: both bootstrap requests block the constructor
+        eager = [measure(lazy=False, bootstrap_file=Path(tmp) / f"cold{i}.json") for i in range(RUNS)]
+
+        # After: values are served from a warm cache file, no network at all
+        warm = Path(tmp) / "warm.json"
+        measure(lazy=False, bootstrap_file=warm)
+        cached = [measure(bootstrap_file=warm) for _ in range(RUNS)]
+
+    print(f"eager bootstrap : {min(eager) * 1000:8.2f} ms (best of {RUNS})")
+    print(f"cached bootstrap: {min(cached) * 1000:8.2f} ms (best of {RUNS})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Memory of a parsed library: dict per track vs slotted Track records.
+
+Run from the repository root: python benchmarks/track_memory.py
+"""
+import gc
+import json
+import random
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from soundcloud import parse_likes, select_transcoding, transcoding_codec  # noqa: E402
+
+#: Liked tracks of the synthetic library
+TRACKS = 10_000
+#: Distinct uploaders, most people like several tracks of the same artists
+AUTHORS = 800
+
+
+def parse_likes_dicts(likes: dict) -> list:
+    # What the library parser returned before Track
+    tracks = []
+    for item in likes["collection"]:
+        if "track" not in item:
+            continue
+        track = item["track"]
+        transcoding = select_transcoding(track.get("media", {}).get("transcodings") or []) or {}
+        tracks.append(
+            {
+                "track_id": track["id"],
+                "title": track["title"],
+                "author": track["user"]["username"],
+                "artwork_url": track.get("artwork_url"),
+                "url": transcoding.get("url"),
+                "auth": track.get("track_authorization"),
+                "duration": track.get("duration", 0),
+                "liked_at": item.get("created_at", ""),
+                "codec": transcoding_codec(transcoding),
+                "protocol": transcoding.get("format", {}).get("protocol"),
+            }
+        )
+    return tracks
+
+
+def likes_page() -> str:
+    """API likes JSON of the whole library, as the sync would receive it"""
+    random.seed(0)
+    collection = []
+    for i in range(TRACKS):
+        track_id = 1_000_000_000 + i
+        collection.append({
+            "created_at": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T12:00:{i % 60:02d}Z",
+            "track": {
+                "id": track_id,
+                "title": f"Track title number {i}",
+                "user": {"username": f"artist_{random.randrange(AUTHORS)}"},
+                "artwork_url": f"https://i1.sndcdn.com/artworks-{track_id:x}abcdef-large.jpg",
+                "track_authorization": f"eyJ0eXAiOiJKV1QiLCJhbGciOiJIUzI1NiJ9.{track_id:x}" * 3,
+                "duration": random.randrange(60_000, 600_000),
+                "media": {"transcodings": [{
+                    "url": f"https://api-v2.soundcloud.com/media/soundcloud:tracks:{track_id}/stream/progressive",
+                    "preset": "mp3_1_0",
+                    "snipped": False,
+                    "format": {"protocol": "progressive", "mime_type": "audio/mpeg"},
+                }]},
+            },
+        })
+    return json.dumps({"collection": collection, "next_href": None})
+
+
+def retained(parser, text: str):
+    """Bytes still allocated by the parsed tracks once the raw page is gone"""
+    gc.collect()
+    tracemalloc.start()
+    likes = json.loads(text)
+    tracks = parser(likes)
+    del likes
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, tracks
+
+
+def main():
+    text = likes_page()
+    dicts_size, dicts = retained(parse_likes_dicts, text)
+    del dicts
+    tracks_size, tracks = retained(parse_likes, text)
+
+    print(f"{len(tracks)} tracks, {AUTHORS} authors")
+    print(f"dicts : {dicts_size / 1024 / 1024:7.2f} MiB ({dicts_size / TRACKS:6.0f} B/track)")
+    print(f"Track : {tracks_size / 1024 / 1024:7.2f} MiB ({tracks_size / TRACKS:6.0f} B/track, "
+          f"{1 - tracks_size / dicts_size:.0%} less)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import base64
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+import requests
+from cache import CACHE_DIR
+from soundcloud import make_session, DEFAULT_TIMEOUT
+
+#: Downloaded covers, <hash>-<size>.jpg
+ARTWORK_DIR = CACHE_DIR / "artwork"
+
+#: SoundCloud size variants: small one for list rows, big one for the player
+THUMBNAIL = "t120x120"
+COVER = "t500x500"
+
+#: Concurrent cover downloads
+ARTWORK_WORKERS = 4
+
+#: Byte budget of the artwork directory, least recently shown covers go first
+ARTWORK_BUDGET = 100 * 1024 * 1024
+
+#: Transparent 1x1 PNG shown until a cover is on disk or when a track has none
+PLACEHOLDER_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+def artwork_variant(url: str, size: str) -> str:
+    """Url of another size of a SoundCloud cover (api urls end in -large.jpg)"""
+    return url.replace("-large.", f"-{size}.")
+
+
+class ArtworkCache:
+    """
+    Covers downloaded once and served from local disk.
+
+    Each size of a cover is fetched on first use by a bounded thread pool;
+    meanwhile and for tracks without artwork a local placeholder is shown.
+    Files are evicted by last use when the directory exceeds its budget.
+    """
+
+    def __init__(self, session: requests.Session = None, directory=ARTWORK_DIR, workers: int = ARTWORK_WORKERS,
+                 budget: int = ARTWORK_BUDGET, timeout=DEFAULT_TIMEOUT):
+        self.session = session or make_session(pool_size=workers)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.budget = budget
+        self.timeout = timeout
+        self.lock = Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="artwork")
+        #: Path -> Future of a running download
+        self.pending = {}
+
+        self.placeholder = self.directory / "placeholder.png"
+        if not self.placeholder.exists():
+            self.placeholder.write_bytes(PLACEHOLDER_PNG)
+        #: Path -> size of the covers on disk
+        self.files = {
+            path: path.stat().st_size for path in self.directory.glob("*.jpg")
+        }
+
+    def path(self, url: str, size: str) -> Path:
+        digest = hashlib.blake2b(url.encode(), digest_size=10).hexdigest()
+        return self.directory / f"{digest}-{size}.jpg"
+
+    def get(self, url: str, size: str = THUMBNAIL, on_ready=None) -> str:
+        """
+        Local file to show for a cover.
+
+        Returns the cached file, or the placeholder while the cover is
+        downloaded in background; on_ready(path) is called once it's on disk.
+        """
+        if not url:
+            return str(self.placeholder)
+        path = self.path(url, size)
+        with self.lock:
+            cached = path in self.files
+        if cached:
+            try:
+                # Last use decides the eviction order
+                os.utime(path)
+                return str(path)
+            except FileNotFoundError:
+                with self.lock:
+                    self.files.pop(path, None)
+        future = self.fetch(url, size)
+        if on_ready is not None:
+            future.add_done_callback(lambda f: self._ready(f, on_ready))
+        return str(self.placeholder)
+
+    @staticmethod
+    def _ready(future, on_ready) -> None:
+        try:
+            path = future.result()
+        except Exception as ex:
+            # The placeholder stays, the cover is tried again next time it's shown
+            print(f"Artwork download failed: {ex}")
+            return
+        on_ready(str(path))
+
+    def fetch(self, url: str, size: str):
+        """Download a cover in background, returns a Future of its path"""
+        path = self.path(url, size)
+        with self.lock:
+            future = self.pending.get(path)
+            if future is not None:
+                return future
+            future = self.pending[path] = self.pool.submit(self._download, artwork_variant(url, size), path)
+        future.add_done_callback(lambda _: self._done(path))
+        return future
+
+    def _done(self, path: Path) -> None:
+        with self.lock:
+            self.pending.pop(path, None)
+
+    def _download(self, url: str, path: Path) -> Path:
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        part_file = path.with_suffix(".part")
+        part_file.write_bytes(response.content)
+        os.replace(part_file, path)
+        with self.lock:
+            self.files[path] = len(response.content)
+        self.evict()
+        return path
+
+    def size(self) -> int:
+        with self.lock:
+            return sum(self.files.values())
+
+    def evict(self) -> int:
+        """Delete least recently used covers until the budget fits, return evicted count"""
+        evicted = 0
+        with self.lock:
+            total = sum(self.files.values())
+            if total <= self.budget:
+                return 0
+            for path in sorted(self.files, key=lambda path: path.stat().st_mtime if path.exists() else 0):
+                if total <= self.budget:
+                    break
+                total -= self.files.pop(path)
+                path.unlink(missing_ok=True)
+                evicted += 1
+        return evicted
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+import ffmpeg
+from threading import RLock
+from time import time
+
+#: Directory with cached tracks
+CACHE_DIR = Path.home() / ".soundcloud"
+
+#: Containers a cached track can be stored in
+CACHE_EXTENSIONS = (".mp3", ".m4a", ".opus")
+
+#: Default byte budget of the audio cache
+CACHE_BUDGET = 2 * 1024 * 1024 * 1024
+
+#: "lru" evicts the least recently played track, "lfu" the least played one
+CACHE_POLICY = "lru"
+
+#: Bytes hashed at each end of a file for its quick fingerprint
+HASH_CHUNK = 64 * 1024
+
+#: A file shorter than this share of the expected duration is truncated
+MIN_DURATION_RATIO = 0.95
+
+#: Segments of unfinished HLS downloads older than this (seconds) are dropped at startup
+SEGMENTS_TTL = 24 * 3600
+
+#: Segment directories changed this recently (seconds) may belong to a running download
+SEGMENTS_ACTIVE = 60
+
+
+def quick_hash(path: Path) -> str:
+    """Fingerprint of size + first and last HASH_CHUNK bytes, no full read"""
+    size = path.stat().st_size
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(HASH_CHUNK))
+        if size > HASH_CHUNK:
+            f.seek(max(HASH_CHUNK, size - HASH_CHUNK))
+            digest.update(f.read(HASH_CHUNK))
+    return digest.hexdigest()
+
+
+def probe_duration(path: Path):
+    """Duration of an audio file in seconds, None if it can't be read"""
+    try:
+        return float(ffmpeg.probe(str(path))["format"]["duration"])
+    except (ffmpeg.Error, KeyError, ValueError):
+        return None
+
+
+def commit_file(part_file: Path, output_file: Path) -> None:
+    """Flush a finished temporary file to disk and atomically move it into place"""
+    with open(part_file, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(part_file, output_file)
+    # Persist the rename itself
+    dir_fd = os.open(output_file.parent, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class AudioCache:
+    """
+    Bounded audio cache of ~/.soundcloud/<track_id>.<ext>.
+
+    Play history, counters and a manifest (size, mtime, quick hash,
+    duration) of every file live in index.json next to the files. When
+    the stored bytes exceed the budget, tracks are evicted by policy;
+    pinned tracks (the current queue) are never evicted.
+    """
+
+    def __init__(self, directory=CACHE_DIR, budget: int = CACHE_BUDGET, policy: str = CACHE_POLICY):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.budget = budget
+        self.policy = policy
+        self.index_file = self.directory / "index.json"
+        #: Resumable HLS segments, counted against the budget and evicted first
+        self.segments_dir = self.directory / "segments"
+        self.lock = RLock()
+        self.pinned = set()
+
+        index = self._read_index()
+        #: track_id (str) -> {"last_used": timestamp, "plays": count}
+        self.history = index.get("history", {})
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, **index.get("counters", {})}
+        #: track_id (str) -> {"size", "mtime", "hash", "duration"} recorded when the file was written
+        self.manifest = index.get("manifest", {})
+
+        #: track_id (str) -> (path, size) of the files on disk
+        self.files = {}
+        for path in self.directory.iterdir():
+            if path.suffix in CACHE_EXTENSIONS and path.stem.isdigit():
+                self.files[path.stem] = (path, path.stat().st_size)
+                self.history.setdefault(path.stem, {"last_used": path.stat().st_mtime, "plays": 0})
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self.index_file, "r") as f:
+                return dict(json.load(f))
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self) -> None:
+        tmp_file = self.index_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump({"history": self.history, "counters": self.counters, "manifest": self.manifest}, f)
+        os.replace(tmp_file, self.index_file)
+
+    def path(self, track_id, extension: str = ".mp3") -> Path:
+        """Where a track is stored in the given container"""
+        return self.directory / f"{track_id}{extension}"
+
+    def get(self, track_id):
+        """Cached file of a track without touching the stats, None if missing"""
+        with self.lock:
+            entry = self.files.get(str(track_id))
+        return entry[0] if entry else None
+
+    def lookup(self, track_id):
+        """Cached file for playback: counts a hit or a miss, None if missing"""
+        with self.lock:
+            path = self.get(track_id)
+            self.counters["hits" if path else "misses"] += 1
+            self._save_index()
+        return path
+
+    def played(self, track_id) -> None:
+        """Record a play of the track for the eviction policy"""
+        with self.lock:
+            entry = self.history.setdefault(str(track_id), {"last_used": 0, "plays": 0})
+            entry["last_used"] = time()
+            entry["plays"] += 1
+            self._save_index()
+
+    def pin(self, track_ids) -> None:
+        """Replace the set of tracks that must not be evicted (the queue)"""
+        with self.lock:
+            self.pinned = {str(track_id) for track_id in track_ids}
+
+    def _manifest_entry(self, path: Path, duration) -> dict:
+        stat = path.stat()
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "hash": quick_hash(path), "duration": duration}
+
+    def add(self, path: Path, duration=None) -> None:
+        """Register a file that was just written into the cache, then evict over budget"""
+        path = Path(path)
+        if duration is None:
+            duration = probe_duration(path)
+        entry = self._manifest_entry(path, duration)
+        with self.lock:
+            self.files[path.stem] = (path, entry["size"])
+            self.manifest[path.stem] = entry
+            self.history.setdefault(path.stem, {"last_used": time(), "plays": 0})
+            self.evict()
+            self._save_index()
+
+    def remove(self, track_id) -> None:
+        with self.lock:
+            entry = self.files.pop(str(track_id), None)
+            self.manifest.pop(str(track_id), None)
+            if entry:
+                entry[0].unlink(missing_ok=True)
+
+    def size(self) -> int:
+        with self.lock:
+            return sum(size for _, size in self.files.values())
+
+    def unplayed_size(self) -> int:
+        """Bytes of cached tracks that were never played, i.e. prefetched ahead"""
+        with self.lock:
+            return sum(
+                size for track_id, (_, size) in self.files.items()
+                if not self.history.get(track_id, {}).get("plays")
+            )
+
+    def segment_dirs(self) -> list:
+        """(directory, bytes, mtime) of kept HLS segments, oldest first"""
+        if not self.segments_dir.is_dir():
+            return []
+        dirs = []
+        for path in self.segments_dir.iterdir():
+            if path.is_dir():
+                size = sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+                dirs.append((path, size, path.stat().st_mtime))
+        return sorted(dirs, key=lambda entry: entry[2])
+
+    def evict(self) -> int:
+        """Delete tracks by policy until the cache fits its budget, return evicted count"""
+        def score(track_id):
+            entry = self.history.get(track_id, {"last_used": 0, "plays": 0})
+            if self.policy == "lfu":
+                return (entry["plays"], entry["last_used"])
+            return (entry["last_used"], entry["plays"])
+
+        evicted = 0
+        with self.lock:
+            total = self.size()
+            segments = self.segment_dirs()
+            total += sum(size for _, size, _ in segments)
+            # Leftovers of cancelled downloads go before any playable track
+            for path, size, mtime in segments:
+                if total <= self.budget:
+                    break
+                if time() - mtime < SEGMENTS_ACTIVE:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+            for track_id in sorted(self.files, key=score):
+                if total <= self.budget:
+                    break
+                if track_id in self.pinned:
+                    continue
+                total -= self.files[track_id][1]
+                self.remove(track_id)
+                self.history.pop(track_id, None)
+                evicted += 1
+            self.counters["evictions"] += evicted
+        return evicted
+
+    def validate(self, durations: dict = None) -> dict:
+        """
+        Startup check that removes broken entries so they get downloaded again.
+
+        Leftovers of interrupted writes and HLS segments older than
+        SEGMENTS_TTL are deleted. A file whose size and
+        mtime match its manifest is trusted without reading it; otherwise
+        its quick hash decides. Files without a manifest (written by older
+        versions) are probed once and dropped if unreadable or shorter than
+        the expected duration.
+
+        Args:
+            durations (dict): Expected track durations in ms by track id.
+
+        Returns:
+            dict: Counts of "partials", "removed" and "adopted" files.
+        """
+        durations = {str(k): v for k, v in (durations or {}).items()}
+        result = {"partials": 0, "removed": 0, "adopted": 0}
+        with self.lock:
+            for path in self.directory.iterdir():
+                if ".part" in path.suffixes or path.suffix in (".hls", ".tmp"):
+                    path.unlink(missing_ok=True)
+                    result["partials"] += 1
+            for path, _, mtime in self.segment_dirs():
+                if time() - mtime >= SEGMENTS_TTL:
+                    shutil.rmtree(path, ignore_errors=True)
+                    result["partials"] += 1
+
+            for track_id, (path, size) in list(self.files.items()):
+                entry = self.manifest.get(track_id)
+                if entry is not None:
+                    stat = path.stat()
+                    if stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+                        continue
+                    if stat.st_size == entry["size"] and quick_hash(path) == entry["hash"]:
+                        entry["mtime"] = stat.st_mtime
+                        continue
+                else:
+                    duration = probe_duration(path)
+                    expected = durations.get(track_id)
+                    if duration is not None and not (expected and duration * 1000 < expected * MIN_DURATION_RATIO):
+                        self.manifest[track_id] = self._manifest_entry(path, duration)
+                        result["adopted"] += 1
+                        continue
+                self.remove(track_id)
+                result["removed"] += 1
+            self._save_index()
+        return result
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                "files": len(self.files),
+                "bytes": self.size(),
+                "budget": self.budget,
+                "hits": self.counters["hits"],
+                "misses": self.counters["misses"],
+                "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                "evictions": self.counters["evictions"],
+                "pinned": len(self.pinned),
+            }
+
+    def report(self) -> str:
+        """Human readable cache stats"""
+        stats = self.stats()
+        return (f"{stats['files']} tracks, {stats['bytes'] / 1024 ** 2:.0f}/{stats['budget'] / 1024 ** 2:.0f} MiB, "
+                f"hit rate {stats['hit_rate']:.0%} ({stats['hits']} hits, {stats['misses']} misses), "
+                f"{stats['evictions']} evictions")
@@ -1,25 +1,38 @@
-import os
-from pathlib import Path
-from soundcloud import Soundcloud
-import vlc
-import threading
-from time import sleep
+import asyncio
+from soundcloud import Soundcloud, AsyncSoundcloud, next_offset, parse_likes
+from downloader import DownloadService, FirstAudioMeter, PLAY_NOW, PROGRESSIVE, resolve_track
+from cache import AudioCache
+from library import LibrarySync, LibraryStore, END_OFFSET, track_index
+from player import create_player
 class SoundCloudConsolePlayer:
     def __init__(self):
-        # Create cache directory if it doesn't exist
-        self.cache_dir = Path.home() / ".soundcloud"
-        self.cache_dir.mkdir(exist_ok=True)
-        
         # Initialize client and variables
         self.client = Soundcloud("", "AsIBxSC4kw4QXdGp0vufY0YztIlkRMUc")
-        self.audio_player = vlc.MediaPlayer()
-        self.liked_tracks = []
-        self.offset = 0
+        # No position events: the console only needs the state and the track end
+        self.audio_player = create_player(position_rate=0)
+        self.audio_player.subscribe(self.on_player_event)
+        # Index of the track handed to the player for a gapless start
+        self.queued = None
+        # Liked tracks are served from the local library, network only fills the gaps
+        self.library = LibraryStore()
+        self.cache = AudioCache()
+        # Drop truncated or corrupt files left by a crash, they are downloaded again
+        print(f"Cache validation: {self.cache.validate(self.library.durations())}")
+        self.downloads = DownloadService(self.client, self.cache, store=self.library)
+        self.downloads.subscribe(self.on_download_event)
+        self.progressive = PROGRESSIVE
+        self.first_audio = FirstAudioMeter()
+        self.liked_tracks = self.library.tracks()
+        self.offset = self.library.get_meta("next_offset", "0")
+        self.refreshed = False
         self.index = -1
 
-    def download_track(self, url, output_file):
-        """Download a track using ffmpeg."""
-        os.system(f"ffmpeg -i '{url}' -vn -ar 44100 -ac 2 -b:a 192k '{output_file}'")
+    def download_track(self, track, stream_url):
+        """Download a track ahead of any prefetch, return the cached file."""
+        path = self.downloads.submit(track, PLAY_NOW, stream_url=stream_url).wait()
+        if path is None:
+            raise RuntimeError(f"Download of {track.title} failed")
+        return str(path)
 
     def load_likes(self, offset="0"):
         """Fetch liked tracks."""
@@ -30,53 +43,109 @@ class SoundCloudConsolePlayer:
                 print("No more tracks found.")
                 return -1  # No more tracks
 
-            self.offset = likes.get("next_href", None)
-            for item in likes["collection"]:
-                if "playlist" in item:
-                    continue  # Skip playlists
-                track = item["track"]
-                self.liked_tracks.append({
-                    "title": track["title"],
-                    "url": track["media"]["transcodings"][0]["url"],
-                    "auth": track.get("track_authorization"),
-                    "artwork_url": track.get("artwork_url", "https://via.placeholder.com/500"),
-                    "track_id": track["id"],
-                    "author": track["user"]["username"],
-                })
+            offset = next_offset(likes)
+            self.offset = END_OFFSET if offset is None else offset
+            tracks = parse_likes(likes)
+            self.library.add(tracks)
+            self.library.set_meta("next_offset", self.offset)
+            self.liked_tracks.extend(tracks)
             return 0
         except Exception as ex:
             print(f"Error fetching likes: {ex}")
             return -1
 
-    def play_track(self, index):
-        """Play the track at the given index."""
+    def refresh_library(self):
+        """Apply likes/unlikes from the first likes page to the stored library."""
+        self.refreshed = True
+        try:
+            sync = LibrarySync(AsyncSoundcloud.wrap(self.client), page_size=24)
+            stats = asyncio.run(sync.delta(self.library))
+            print(f"Library delta sync: {stats}")
+            if stats.changed:
+                self.reload_tracks()
+        except Exception as ex:
+            print(f"Error refreshing library: {ex}")
+
+    def reload_tracks(self):
+        """Rebuild the track list from the library, following the playing and the queued track."""
+        playing = self.liked_tracks[self.index].track_id if self.index >= 0 else None
+        queued = None if self.queued is None else self.liked_tracks[self.queued].track_id
+        self.liked_tracks = self.library.tracks()
+        self.index = track_index(self.liked_tracks, playing, -1)
+        # The queued track is only right if it still follows the playing one
+        if queued is None or track_index(self.liked_tracks, queued) != self.index + 1:
+            self.queued = None
+            if self.index >= 0:
+                self.queue_gapless()
+        else:
+            self.queued = self.index + 1
+
+    def play_track(self, index, queued=False):
+        """Play the track at the given index, only announce it if the player already started it."""
         track = self.liked_tracks[index]
-        title = track["title"]
-        url = track["url"]
-        auth = track["auth"]
-        track_id = track["track_id"]
-
-        cache_file = self.cache_dir / f"{track_id}.mp3"
-        if not cache_file.exists():
-            print(f"Downloading {title}...")
-            stream_url = self.client.get_stream(url, auth)["url"]
-            self.download_track(stream_url, cache_file)
-
-        self.audio_player.set_media(vlc.Media(str(cache_file)))
-        self.audio_player.play()
+        title = track.title
+        track_id = track.track_id
+
+        if not queued:
+            self.first_audio.start(track_id)
+            cache_file = self.cache.lookup(track_id)
+            self.cache.played(track_id)
+            media = str(cache_file)
+            if cache_file is None:
+                print(f"Downloading {title}...")
+                # A stale stored authorization is refreshed from the API
+                stream_url = resolve_track(self.client, track, self.library)
+                if self.progressive:
+                    # Play straight from the stream, the cache file is written in parallel
+                    # (a prefetch of this track already in flight is reused)
+                    self.downloads.submit(track, PLAY_NOW, stream_url=stream_url)
+                    media = stream_url
+                else:
+                    media = self.download_track(track, stream_url)
+
+            self.audio_player.set_media(media)
+            self.audio_player.play()
+            self.queued = None
+        else:
+            self.cache.played(track_id)
         self.index = index
         
-        print(f"Now playing: {title} by {track['author']}")
+        print(f"Now playing: {title} by {track.author}")
 
-    def on_track_end(self):
-        while True:
-            sleep(0.1)
-            if (
-                self.audio_player.get_position() > 0.97
-                and not self.audio_player.is_playing()
-                ):
-                    self.next_track()
+        # Pre-download the next tracks so skipping to them is instant
+        upcoming = self.liked_tracks[index + 1 : index + 1 + self.downloads.depth]
+        self.cache.pin([track_id] + [track.track_id for track in upcoming])
+        self.downloads.prefetch(upcoming)
+        self.queue_gapless()
+
+    def queue_gapless(self):
+        """Hand the next track to the player once it is cached, so it starts without a gap."""
+        index = self.index + 1
+        if index >= len(self.liked_tracks) or self.queued == index:
+            return
+        path = self.cache.get(self.liked_tracks[index].track_id)
+        if path is not None and self.audio_player.queue_next(str(path)):
+            self.queued = index
+
+    def on_download_event(self, job, event):
+        if event == "done" and self.queued is None:
+            # The prefetch of the next track may have just finished
+            self.queue_gapless()
 
+    def on_player_event(self, event, value):
+        """Report the first audio and play the next track at the end of the media."""
+        if event == "ready":
+            print("Player not ready" if value is None else f"Player ready in {value:.2f}s")
+        elif event == "state":
+            if value == "Playing" and self.first_audio.requested is not None:
+                print(f"Time to first audio: {self.first_audio.playing():.2f}s")
+        elif event == "next":
+            # The player moved on to the queued track by itself
+            if self.queued is not None:
+                index, self.queued = self.queued, None
+                self.play_track(index, queued=True)
+        elif event == "end":
+            self.next_track()
 
     def next_track(self):
         """Play the next track."""
@@ -97,20 +166,21 @@ class SoundCloudConsolePlayer:
         if not self.liked_tracks:
             print("No liked tracks loaded. Fetching more...")
             self.load_likes()
+        elif not self.refreshed:
+            self.refresh_library()
         for i, track in enumerate(self.liked_tracks):
-            print(f"{i + 1}. {track['title']} by {track['author']}")
+            print(f"{i + 1}. {track.title} by {track.author}")
 
     def main_menu(self):
         """Main menu of the application."""
-        t1 = threading.Thread(target=self.on_track_end, daemon=True)
-        t1.start()
         while True:
             print("\n=== SoundCloud Console Player ===")
             print("1. Show liked tracks")
             print("2. Play track")
             print("3. Next track")
             print("4. Previous track")
-            print("5. Quit")
+            print("5. Cache stats")
+            print("6. Quit")
             choice = input("Select an option: ").strip()
 
             if choice == "1":
@@ -128,7 +198,10 @@ class SoundCloudConsolePlayer:
             elif choice == "4":
                 self.prev_track()
             elif choice == "5":
+                print(self.cache.report())
+            elif choice == "6":
                 print("Goodbye!")
+                self.client.close()
                 break
             else:
                 print("Invalid option. Try again.")
@@ -0,0 +1,453 @@
+import heapq
+import itertools
+import subprocess
+import threading
+from pathlib import Path
+from time import perf_counter, sleep
+import ffmpeg
+import eyed3
+import requests
+from soundcloud import Soundcloud, Track, make_session, parse_track
+from hls import HLSDownloader, HLS_WORKERS, Throttle, fetch_file, is_hls
+from cache import AudioCache, commit_file
+
+#: Defaults for the background pre-download of upcoming tracks
+PREFETCH_DEPTH = 3
+PREFETCH_MAX_RATE = None  # bytes per second, None for unlimited
+
+#: Bytes of prefetched, not yet played tracks the cache may hold
+PREFETCH_DISK_BUDGET = 256 * 1024 * 1024
+
+#: Download workers; one of them is always kept free for "play now" jobs
+DOWNLOAD_WORKERS = 3
+
+#: Job priorities, lower runs first
+PLAY_NOW = 0
+PREFETCH = 1
+
+#: Start playback from the stream while the cache file is written in parallel
+PROGRESSIVE = True
+
+#: "copy" keeps the original codec (no re-encode), "mp3" transcodes like before
+CACHE_MODE = "copy"
+
+#: Container used to stream-copy each source codec: codec -> (extension, ffmpeg format)
+COPY_CONTAINERS = {
+    "mp3": (".mp3", "mp3"),
+    "aac": (".m4a", "ipod"),
+    "opus": (".opus", "opus"),
+}
+
+
+def probe_codec(url: str):
+    """Codec name of the first audio stream, None if it can't be probed"""
+    try:
+        streams = ffmpeg.probe(url, select_streams="a:0")["streams"]
+    except ffmpeg.Error:
+        return None
+    return streams[0]["codec_name"] if streams else None
+
+
+def resolve_stream(client: Soundcloud, url: str, auth: str, retries: int = 20) -> str:
+    """Resolve a transcoding url into a playable stream url"""
+    for _ in range(retries):
+        try:
+            return client.get_stream(url, auth)["url"]
+        except KeyError:
+            sleep(0.1)  # Retry after a short delay.
+    raise RuntimeError(f"Stream is not available: {url}")
+
+
+#: Attempts with the stored url and authorization before the track is looked up again
+STORED_RETRIES = 3
+
+
+def resolve_track(client: Soundcloud, track: Track, store=None) -> str:
+    """
+    Resolve the stream url of a Track.
+
+    The url and track_authorization stored in the library go stale; when
+    they don't resolve, the track's metadata is fetched again, updated in
+    place and saved to store (anything with add(tracks)), then retried.
+    """
+    try:
+        return resolve_stream(client, track.url, track.auth, STORED_RETRIES)
+    except (RuntimeError, ValueError, requests.RequestException) as ex:
+        print(f"Stored stream of {track.track_id} failed ({ex}), refreshing the track")
+    fresh = parse_track(client.get_track(track.track_id), track.liked_at)
+    track.url, track.auth = fresh.url, fresh.auth
+    track.codec, track.protocol = fresh.codec, fresh.protocol
+    if store is not None:
+        store.add([track])
+    return resolve_stream(client, track.url, track.auth)
+
+
+def run_ffmpeg(stream, cancelled=None) -> None:
+    """Run an ffmpeg-python stream, killing it as soon as cancelled() is True"""
+    process = stream.run_async()
+    while True:
+        try:
+            process.wait(timeout=0.2)
+            break
+        except subprocess.TimeoutExpired:
+            if cancelled is not None and cancelled():
+                process.kill()
+                process.wait()
+                raise InterruptedError("ffmpeg cancelled")
+    if process.returncode != 0:
+        raise ffmpeg.Error("ffmpeg", None, None)
+
+
+def download_mp3(url: str, output_file, title: str, artist: str, cancelled=None) -> None:
+    """
+    Download a track from the given stream URL into an MP3 file and tag it.
+
+    Args:
+        url (str): The streaming URL of the audio track.
+        output_file (str): The file path where the downloaded MP3 will be saved.
+        title (str): Title tag.
+        artist (str): Artist tag.
+        cancelled (callable): Polled while ffmpeg runs; True kills it.
+    """
+    run_ffmpeg(
+        ffmpeg.input(url).output(str(output_file), format="mp3", loglevel="quiet").overwrite_output(),
+        cancelled,
+    )
+    tags = eyed3.load(str(output_file))
+    tags.tag.title = title #pyright:ignore
+    tags.tag.artist = artist #pyright:ignore
+    tags.tag.save() #pyright:ignore
+
+
+def download_copy(url: str, output_file, container: str, title: str, artist: str, cancelled=None) -> None:
+    """
+    Download a track keeping its original codec (no re-encode).
+
+    Tags are written by the ffmpeg muxer, so each container gets its own
+    kind: ID3v2 for mp3, iTunes atoms for m4a, Vorbis comments for opus.
+    """
+    stream = ffmpeg.input(url).output(
+        str(output_file),
+        format=container,
+        acodec="copy",
+        vn=None,
+        loglevel="quiet",
+        # ADTS frames from HLS segments need a global header in mp4
+        **({"bsf:a": "aac_adtstoasc"} if container == "ipod" else {}),
+        # One -metadata option per tag, ffmpeg-python would join a list into one value
+        **{"metadata:g:0": f"title={title}", "metadata:g:1": f"artist={artist}"},
+    ).overwrite_output()
+    run_ffmpeg(stream, cancelled)
+
+
+def download_to_cache(stream_url: str, track_id, title: str, artist: str, cache: AudioCache,
+                      mode: str = CACHE_MODE, codec=None, hls: HLSDownloader = None,
+                      progress=None, cancelled=None, throttle: Throttle = None) -> Path:
+    """
+    Download a stream into the cache under a temporary name.
+
+    Args:
+        cache (AudioCache): Cache the file is added to (may evict others).
+        mode (str): "copy" to keep the source codec, "mp3" to transcode.
+        codec (str): Source codec if known, probed otherwise (copy mode).
+        hls (HLSDownloader): Fetches HLS segments in parallel; without it
+            ffmpeg reads the playlist one segment at a time.
+        progress (callable): Called with the finished share (0..1) when known.
+        cancelled (callable): Polled during the download; True aborts it
+            with InterruptedError.
+        throttle (Throttle): Paces the network transfer; the stream is then
+            fetched into a local file first, as ffmpeg can't be paced.
+
+    Returns:
+        Path: The cached file.
+    """
+    local_file = None
+    try:
+        if hls is not None and is_hls(stream_url):
+            local_file = cache.path(track_id, ".hls")
+            stats = hls.download(stream_url, track_id, local_file, progress, cancelled, throttle)
+            print(f"HLS download of {track_id}: {stats}")
+            stream_url = str(local_file)
+        elif hls is not None and throttle is not None:
+            local_file = cache.path(track_id, ".tmp")
+            fetch_file(hls.session, stream_url, local_file, hls.timeout, throttle, progress, cancelled)
+            stream_url = str(local_file)
+
+        output_file = _store(stream_url, track_id, title, artist, cache, mode, codec, cancelled)
+    finally:
+        if local_file is not None:
+            local_file.unlink(missing_ok=True)
+    cache.add(output_file)
+    return output_file
+
+
+def _store(stream_url: str, track_id, title: str, artist: str, cache: AudioCache, mode: str, codec, cancelled) -> Path:
+    container = None
+    if mode == "copy":
+        container = COPY_CONTAINERS.get(codec or probe_codec(stream_url))
+
+    if container is None:
+        # Transcode to mp3 (mode "mp3" or a codec that has no copy container)
+        output_file = cache.path(track_id)
+        part_file = output_file.with_suffix(".part.mp3")
+        download_mp3(stream_url, part_file, title, artist, cancelled)
+    else:
+        extension, format_name = container
+        output_file = cache.path(track_id, extension)
+        part_file = output_file.with_suffix(".part" + extension)
+        download_copy(stream_url, part_file, format_name, title, artist, cancelled)
+
+    # Written under a temporary name so a half-done file never looks cached
+    commit_file(part_file, output_file)
+    return output_file
+
+
+class FirstAudioMeter:
+    """Time from a play request until the player reports playback, per track"""
+
+    def __init__(self, grace: float = 10.0):
+        #: Seconds a request may wait for audio before it is treated as failed
+        self.grace = grace
+        self.samples = {}
+        self.track_id = None
+        self.requested = None
+
+    def start(self, track_id) -> None:
+        self.track_id = track_id
+        self.requested = perf_counter()
+
+    def waiting(self) -> bool:
+        """True while the last request hasn't produced audio yet (within grace)"""
+        return self.requested is not None and perf_counter() - self.requested < self.grace
+
+    def playing(self):
+        """Record the first audio of the last request, return seconds or None"""
+        if self.requested is None:
+            return None
+        elapsed = perf_counter() - self.requested
+        self.samples[self.track_id] = elapsed
+        self.requested = None
+        return elapsed
+
+    @property
+    def average(self) -> float:
+        return sum(self.samples.values()) / len(self.samples) if self.samples else 0.0
+
+
+class DownloadJob:
+    """One track download handled by DownloadService"""
+
+    def __init__(self, track: Track, priority: int, stream_url: str = None):
+        self.track = track
+        self.track_id = track.track_id
+        self.priority = priority
+        self.stream_url = stream_url
+        #: queued, running, done, failed or cancelled
+        self.state = "queued"
+        #: Finished share 0..1, None while unknown
+        self.progress = None
+        self.path = None
+        self.error = None
+        self.cancelled = False
+        #: Cancelled job of the same track still shutting down, waited for before starting
+        self.previous = None
+        self.finished = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the job ends, return the cached file (None on failure)"""
+        self.finished.wait(timeout)
+        return self.path
+
+
+class DownloadService:
+    """
+    Bounded pool of download workers fed by a priority queue.
+
+    Requests for a Track that is already queued or running share one job;
+    a "play now" request bumps a queued prefetch of the same track, and a
+    request for a cancelled one starts a new job.
+    Prefetch jobs never take the last free worker, so "play now" starts
+    without waiting for them. Their transfers share one max_rate (bytes per
+    second) throttle, and they stop while the cache holds disk_budget bytes
+    of tracks that were prefetched but not played yet.
+
+    Subscribers are called from worker threads with (job, event) where
+    event is one of queued, started, progress, done, failed, cancelled.
+    """
+
+    def __init__(self, client: Soundcloud, cache: AudioCache, workers: int = DOWNLOAD_WORKERS,
+                 depth: int = PREFETCH_DEPTH, max_rate=PREFETCH_MAX_RATE, disk_budget: int = None, store=None):
+        self.client = client
+        self.cache = cache
+        #: Library that refreshed track metadata is saved to
+        self.store = store
+        self.depth = depth
+        self.max_rate = max_rate
+        #: Shared by all prefetch transfers, "play now" runs at full speed
+        self.throttle = Throttle(max_rate) if max_rate else None
+        self.disk_budget = min(PREFETCH_DISK_BUDGET, cache.budget) if disk_budget is None else disk_budget
+
+        self.workers = max(2, workers)
+        # Every worker may fetch HLS_WORKERS segments from the same CDN host at
+        # once; a pool that small would drop connections instead of reusing them
+        self.hls = HLSDownloader(make_session(pool_size=self.workers * HLS_WORKERS), segments_dir=cache.segments_dir)
+        self.queue = []
+        self.jobs = {}
+        #: track_id -> cancelled job whose worker hasn't stopped yet
+        self.cancelling = {}
+        self.running_prefetch = 0
+        self.subscribers = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def subscribe(self, callback) -> None:
+        self.subscribers.append(callback)
+
+    def _emit(self, job: DownloadJob, event: str) -> None:
+        for callback in self.subscribers:
+            try:
+                callback(job, event)
+            except Exception as ex:
+                print(f"Download subscriber failed: {ex}")
+
+    def job(self, track_id):
+        """Queued or running job of a track, None if there is none"""
+        with self.cond:
+            return self.jobs.get(track_id)
+
+    def submit(self, track: Track, priority: int = PREFETCH, stream_url: str = None) -> DownloadJob:
+        """Queue a download, or return the job already handling this track"""
+        with self.cond:
+            job = self.jobs.get(track.track_id)
+            if job is not None and job.cancelled:
+                # Never hand out a job that is shutting down
+                del self.jobs[track.track_id]
+                job = None
+            if job is not None:
+                if priority < job.priority and job.state == "queued":
+                    job.priority = priority
+                    heapq.heappush(self.queue, (priority, next(self.counter), job))
+                    self.cond.notify_all()
+                return job
+            job = self.jobs[track.track_id] = DownloadJob(track, priority, stream_url)
+            job.previous = self.cancelling.get(track.track_id)
+            heapq.heappush(self.queue, (priority, next(self.counter), job))
+            self.cond.notify_all()
+        self._emit(job, "queued")
+        return job
+
+    def cancel(self, track_id) -> None:
+        """Drop a queued job or stop a running one"""
+        with self.cond:
+            job = self.jobs.get(track_id)
+            if job is None:
+                return
+            job.cancelled = True
+            # A new request for the track gets a fresh job from now on
+            del self.jobs[track_id]
+            if job.state != "queued":
+                # The worker notices the flag and finishes the job itself
+                self.cancelling[track_id] = job
+                return
+            self._finish(job, "cancelled")
+        self._emit(job, "cancelled")
+
+    def prefetch(self, upcoming: list) -> None:
+        """Queue the next tracks (first depth of them), cancel prefetches that left the queue"""
+        upcoming = [track for track in upcoming[: self.depth] if self.cache.get(track.track_id) is None]
+        wanted = {track.track_id for track in upcoming}
+        with self.cond:
+            stale = [job.track_id for job in self.jobs.values()
+                     if job.priority == PREFETCH and job.track_id not in wanted]
+        for track_id in stale:
+            self.cancel(track_id)
+        for track in upcoming:
+            self.submit(track, PREFETCH)
+
+    def wait(self, track_id, timeout=None):
+        """Block while track_id is downloading, return the cached file if any"""
+        job = self.job(track_id)
+        return job.wait(timeout) if job is not None else self.cache.get(track_id)
+
+    def _finish(self, job: DownloadJob, state: str) -> None:
+        # Called with self.cond held
+        job.state = state
+        if self.jobs.get(job.track_id) is job:
+            del self.jobs[job.track_id]
+        if self.cancelling.get(job.track_id) is job:
+            del self.cancelling[job.track_id]
+        job.finished.set()
+        self.cond.notify_all()
+
+    def _next_job(self):
+        # Called with self.cond held; skips entries of finished or re-prioritised jobs
+        while self.queue:
+            priority, _, job = self.queue[0]
+            if job.state != "queued" or priority != job.priority:
+                heapq.heappop(self.queue)
+                continue
+            if priority == PREFETCH and self.running_prefetch >= self.workers - 1:
+                return None
+            heapq.heappop(self.queue)
+            return job
+        return None
+
+    def _run(self) -> None:
+        while True:
+            with self.cond:
+                job = None
+                while job is None:
+                    job = self._next_job()
+                    if job is None:
+                        self.cond.wait()
+                job.state = "running"
+                if job.priority == PREFETCH:
+                    self.running_prefetch += 1
+            self._emit(job, "started")
+
+            state = "done"
+            try:
+                job.path = self._download(job)
+            except InterruptedError:
+                state = "cancelled"
+            except Exception as ex:
+                job.error = ex
+                state = "failed"
+                print(f"Download of {job.track_id} failed: {ex}")
+
+            with self.cond:
+                if job.priority == PREFETCH:
+                    self.running_prefetch -= 1
+                self._finish(job, state)
+            self._emit(job, state)
+
+    def _download(self, job: DownloadJob) -> Path:
+        """Download one track into the cache, return the cached file"""
+        track = job.track
+        if job.previous is not None:
+            # Both would write the same temporary files
+            job.previous.wait()
+            job.previous = None
+        cached = self.cache.get(job.track_id)
+        if cached is not None:
+            return cached
+        if job.priority == PREFETCH and self.cache.unplayed_size() >= self.disk_budget:
+            raise InterruptedError("Prefetch disk budget reached")
+
+        def progress(value):
+            job.progress = value
+            self._emit(job, "progress")
+
+        stream_url = job.stream_url or resolve_track(self.client, track, self.store)
+        return download_to_cache(
+            stream_url, job.track_id, track.title, track.author, self.cache,
+            codec=track.codec, hls=self.hls, progress=progress, cancelled=lambda: job.cancelled,
+            throttle=self.throttle if job.priority == PREFETCH else None,
+        )
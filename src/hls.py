@@ -0,0 +1,205 @@
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, sleep
+from urllib.parse import urljoin, urlparse
+import requests
+
+#: Completed segments of unfinished downloads, kept to resume after a crash,
+#: in <track_id>-<playlist fingerprint> directories
+SEGMENTS_DIR = Path.home() / ".soundcloud" / "segments"
+
+#: Concurrent segment requests per track
+HLS_WORKERS = 8
+
+#: Bytes read per step of a throttled transfer
+CHUNK_SIZE = 64 * 1024
+
+
+def is_hls(url: str) -> bool:
+    return urlparse(url).path.endswith(".m3u8")
+
+
+def parse_playlist(text: str, base_url: str):
+    """
+    Parse a media playlist.
+
+    Returns:
+        tuple: (init segment url or None, list of segment urls)
+    """
+    init = None
+    segments = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-MAP:"):
+            # fMP4 playlists carry the codec header in a separate init segment
+            for attribute in line[len("#EXT-X-MAP:"):].split(","):
+                key, _, value = attribute.partition("=")
+                if key == "URI":
+                    init = urljoin(base_url, value.strip('"'))
+        elif line and not line.startswith("#"):
+            segments.append(urljoin(base_url, line))
+    return init, segments
+
+
+def playlist_fingerprint(urls: list) -> str:
+    """
+    Short hash of the segment paths of a playlist.
+
+    Query strings (signed, new on every resolve) are left out, so the same
+    transcoding resumes while another codec or bitrate never reuses its
+    segments.
+    """
+    paths = "\n".join(urlparse(url).path for url in urls)
+    return hashlib.blake2b(paths.encode(), digest_size=6).hexdigest()
+
+
+class Throttle:
+    """
+    Token bucket pacing every transfer that shares it to rate bytes per second.
+
+    Readers take tokens for the bytes they just got and sleep off any debt,
+    so parallel segment requests together stay under the rate too.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self.tokens = self.burst
+        self.updated = perf_counter()
+        self.lock = Lock()
+
+    def consume(self, amount: int) -> None:
+        with self.lock:
+            now = perf_counter()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            debt = -self.tokens
+        if debt > 0:
+            sleep(debt / self.rate)
+
+
+def fetch_file(session: requests.Session, url: str, path, timeout, throttle: Throttle = None,
+               progress=None, cancelled=None) -> int:
+    """
+    Stream url into path, return the bytes written.
+
+    Args:
+        throttle (Throttle): Paces the transfer, None for full speed.
+        progress (callable): Called with the finished share (0..1) when the size is known.
+        cancelled (callable): Polled between chunks; True aborts with InterruptedError.
+    """
+    written = 0
+    with session.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        total = int(response.headers.get("Content-Length") or 0)
+        with open(path, "wb") as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                if cancelled is not None and cancelled():
+                    raise InterruptedError(f"Download of {url} cancelled")
+                f.write(chunk)
+                written += len(chunk)
+                if throttle is not None:
+                    throttle.consume(len(chunk))
+                if progress is not None and total:
+                    progress(min(1.0, written / total))
+    return written
+
+
+class HLSStats:
+    """Throughput of one segmented download"""
+
+    def __init__(self, segments: int):
+        self.segments = segments
+        self.resumed = 0
+        self.bytes = 0
+        self.started = perf_counter()
+        self.finished = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or perf_counter()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """Downloaded bytes per second (resumed segments not counted)"""
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.segments} segments ({self.resumed} resumed), {self.bytes / 1024:.0f} KiB "
+                f"in {self.elapsed:.1f}s ({self.throughput / 1024:.0f} KiB/s)")
+
+
+class HLSDownloader:
+    """
+    Fetch the segments of an HLS stream concurrently over a pooled session.
+
+    Each finished segment is kept on disk under SEGMENTS_DIR/<track_id>,
+    so a download killed halfway resumes with the missing segments only.
+    The segments are joined into one file that ffmpeg can stream-copy.
+    """
+
+    def __init__(self, session: requests.Session, workers: int = HLS_WORKERS, timeout=(3.05, 15),
+                 segments_dir=SEGMENTS_DIR):
+        self.session = session
+        self.workers = workers
+        self.timeout = timeout
+        self.segments_dir = Path(segments_dir)
+        #: Stats of the last download per track id
+        self.stats = {}
+
+    def _fetch(self, url: str, path: Path, throttle: Throttle = None) -> int:
+        """Download one segment, return fetched bytes (0 if already on disk)"""
+        if path.exists():
+            return 0
+        part_file = path.with_suffix(".part")
+        size = fetch_file(self.session, url, part_file, self.timeout, throttle)
+        os.replace(part_file, path)
+        return size
+
+    def download(self, playlist_url: str, track_id, output_file, progress=None, cancelled=None,
+                 throttle: Throttle = None) -> HLSStats:
+        """
+        Download all segments of playlist_url and join them into output_file.
+
+        Args:
+            progress (callable): Called with the finished share (0..1) after each segment.
+            cancelled (callable): Polled between segments; True aborts with InterruptedError.
+            throttle (Throttle): Shared by all segment requests, None for full speed.
+        """
+        response = self.session.get(playlist_url, timeout=self.timeout)
+        response.raise_for_status()
+        init, segments = parse_playlist(response.text, playlist_url)
+
+        urls = ([init] if init else []) + segments
+        track_dir = self.segments_dir / f"{track_id}-{playlist_fingerprint(urls)}"
+        track_dir.mkdir(parents=True, exist_ok=True)
+        paths = [track_dir / f"{i:05d}.seg" for i in range(len(urls))]
+
+        stats = self.stats[track_id] = HLSStats(len(urls))
+        stats.resumed = sum(1 for path in paths if path.exists())
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self._fetch, url, path, throttle) for url, path in zip(urls, paths)]
+            for done, future in enumerate(as_completed(futures), 1):
+                stats.bytes += future.result()
+                if cancelled is not None and cancelled():
+                    for pending in futures:
+                        pending.cancel()
+                    # Finished segments stay on disk for a later resume, AudioCache
+                    # drops them once they're stale or the budget needs the room
+                    raise InterruptedError(f"Download of {track_id} cancelled")
+                if progress is not None:
+                    progress(done / len(futures))
+
+        # Segments are plain slices of one stream: concatenation gives a valid file
+        with open(output_file, "wb") as out:
+            for path in paths:
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, out)
+        shutil.rmtree(track_dir, ignore_errors=True)
+        stats.finished = perf_counter()
+        return stats
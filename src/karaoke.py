@@ -0,0 +1,35 @@
+from array import array
+from bisect import bisect_right
+
+#: A lyric line turns active this many ms before it starts
+LEAD_MS = 100
+
+
+class LyricTimeline:
+    """
+    Synced lyric lines sorted by start time.
+
+    The active line of a position is a binary search over the start times,
+    O(log n) per tick, and it doesn't depend on the previous tick, so seeks
+    in both directions need no special handling.
+    """
+
+    def __init__(self, lines, lead: int = LEAD_MS):
+        """
+        Args:
+            lines (iterable): (start_ms, words) pairs in any order.
+            lead (int): Ms a line is activated ahead of its start.
+        """
+        lines = sorted(lines, key=lambda line: line[0])
+        # Packed start times: 8 bytes a line instead of an int object
+        self.times = array("q", (start for start, _ in lines))
+        self.words = tuple(words for _, words in lines)
+        self.lead = lead
+
+    def __len__(self):
+        return len(self.times)
+
+    def line_at(self, position: int):
+        """Index of the active line at position (ms), None before the first line"""
+        index = bisect_right(self.times, position + self.lead) - 1
+        return index if index >= 0 else None
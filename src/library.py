@@ -0,0 +1,261 @@
+import asyncio
+import math
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from soundcloud import AsyncSoundcloud, Track, TRACK_FIELDS, next_offset, parse_likes
+
+#: SQLite file with liked-track metadata
+LIBRARY_FILE = Path.home() / ".soundcloud" / "library.db"
+
+#: Meta value of "next_offset" once the end of the likes is reached
+END_OFFSET = "-1"
+
+#: Page size used when walking the whole collection (API max is 200)
+SYNC_PAGE_SIZE = 200
+
+
+def track_index(tracks: list, track_id, default=None):
+    """Position of a track in a rebuilt track list, default if it's gone"""
+    if track_id is not None:
+        for index, track in enumerate(tracks):
+            if track.track_id == track_id:
+                return index
+    return default
+
+
+class LibraryStore:
+    """
+    Local SQLite index of liked tracks keyed by track id.
+
+    Serves the library instantly on startup; the network is only used to
+    apply the difference found on the first likes page.
+    """
+
+    def __init__(self, path=LIBRARY_FILE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute(
+                """CREATE TABLE IF NOT EXISTS tracks (
+                    track_id INTEGER PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    author TEXT NOT NULL,
+                    artwork_url TEXT,
+                    url TEXT,
+                    auth TEXT,
+                    duration INTEGER NOT NULL DEFAULT 0,
+                    liked_at TEXT NOT NULL DEFAULT '',
+                    codec TEXT,
+                    protocol TEXT
+                )"""
+            )
+            # Libraries created before the format columns existed
+            columns = {row[1] for row in self.db.execute("PRAGMA table_info(tracks)")}
+            for column in ("codec", "protocol"):
+                if column not in columns:
+                    self.db.execute(f"ALTER TABLE tracks ADD COLUMN {column} TEXT")
+            self.db.execute("CREATE INDEX IF NOT EXISTS tracks_liked_at ON tracks (liked_at)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def tracks(self) -> list:
+        """All stored Tracks, most recently liked first"""
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT {', '.join(TRACK_FIELDS)} FROM tracks ORDER BY liked_at DESC, rowid"
+            ).fetchall()
+        return [Track(*row) for row in rows]
+
+    def durations(self) -> dict:
+        """Track durations in ms by track id"""
+        with self.lock:
+            return dict(self.db.execute("SELECT track_id, duration FROM tracks").fetchall())
+
+    def ids(self) -> set:
+        with self.lock:
+            return {row[0] for row in self.db.execute("SELECT track_id FROM tracks")}
+
+    def add(self, tracks: list) -> None:
+        """Insert or update Tracks"""
+        with self.lock, self.db:
+            self.db.executemany(
+                f"INSERT OR REPLACE INTO tracks ({', '.join(TRACK_FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(TRACK_FIELDS))})",
+                [track.astuple() for track in tracks],
+            )
+
+    def apply_first_page(self, likes: dict) -> bool:
+        """
+        Merge the newest likes page into the store.
+
+        New likes are inserted; stored tracks inside the time range covered
+        by the page that are missing from it were unliked and get removed.
+
+        Returns:
+            bool: True if the stored list changed.
+        """
+        tracks = parse_likes(likes)
+        if not tracks:
+            return False
+        known = self.ids()
+        page_ids = [track.track_id for track in tracks]
+        oldest = min(track.liked_at for track in tracks)
+        with self.lock, self.db:
+            removed = self.db.execute(
+                f"DELETE FROM tracks WHERE liked_at >= ? AND track_id NOT IN ({', '.join('?' * len(page_ids))})",
+                (oldest, *page_ids),
+            ).rowcount
+        self.add(tracks)
+        return removed > 0 or any(track_id not in known for track_id in page_ids)
+
+    def get_meta(self, key: str, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key: str, value) -> None:
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+class SyncStats:
+    """Counters of one library sync"""
+
+    def __init__(self):
+        self.pages = 0
+        self.tracks = 0
+        #: Delta sync only: page requests a full walk would have needed on top
+        self.requests_saved = 0
+        #: Delta sync only: stored list changed (likes or unlikes)
+        self.changed = False
+        self.started = perf_counter()
+        self.finished = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or perf_counter()) - self.started
+
+    @property
+    def tracks_per_second(self) -> float:
+        return self.tracks / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        text = f"{self.tracks} tracks, {self.pages} pages in {self.elapsed:.1f}s ({self.tracks_per_second:.0f} tracks/s)"
+        if self.requests_saved:
+            text += f", {self.requests_saved} requests saved"
+        return text
+
+
+class LibrarySync:
+    """
+    Background walk of the whole likes collection.
+
+    Likes cursors are opaque, so pages can only be requested one after
+    another; the fetcher runs ahead of the consumer through a bounded
+    queue so network waits overlap with parsing and UI work.
+    """
+
+    def __init__(self, client: AsyncSoundcloud, page_size: int = SYNC_PAGE_SIZE, prefetch_pages: int = 2):
+        self.client = client
+        self.page_size = page_size
+        self.prefetch_pages = prefetch_pages
+        self.stats = SyncStats()
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    async def _fetch(self, queue: asyncio.Queue, offset: str) -> None:
+        try:
+            while offset is not None and not self.cancelled:
+                likes = await self.client.get_likes(offset=offset, limit=self.page_size)
+                if not likes.get("collection"):
+                    break
+                await queue.put(likes)
+                offset = next_offset(likes)
+        except Exception as ex:
+            # Hand the error over to the consumer
+            await queue.put(ex)
+            return
+        await queue.put(None)
+
+    async def run(self, on_page, offset: str = "0") -> SyncStats:
+        """
+        Stream every likes page into on_page as it arrives.
+
+        Args:
+            on_page (callable): Called (or awaited) with each raw likes page.
+            offset (str): Cursor to start from, "0" for the newest like.
+        """
+        self.stats = SyncStats()
+        queue = asyncio.Queue(maxsize=self.prefetch_pages)
+        fetcher = asyncio.create_task(self._fetch(queue, offset))
+        try:
+            while (likes := await queue.get()) is not None:
+                if isinstance(likes, Exception):
+                    raise likes
+                self.stats.pages += 1
+                self.stats.tracks += sum(1 for item in likes["collection"] if "track" in item)
+                result = on_page(likes)
+                if asyncio.iscoroutine(result):
+                    await result
+        finally:
+            fetcher.cancel()
+            self.stats.finished = perf_counter()
+        return self.stats
+
+    async def delta(self, store: LibraryStore) -> SyncStats:
+        """
+        Fetch only what's new: stop at the first already known track id.
+
+        The first page is merged with apply_first_page so unlikes near the
+        top of the list are picked up too. Pages a full walk would have
+        requested on top are counted in requests_saved and accumulated in
+        the "requests_saved" meta key.
+        """
+        self.stats = stats = SyncStats()
+        known = store.ids()
+        offset = "0"
+        new = []
+        try:
+            while offset is not None and not self.cancelled:
+                likes = await self.client.get_likes(offset=offset, limit=self.page_size)
+                stats.pages += 1
+                tracks = parse_likes(likes)
+                if stats.pages == 1:
+                    stats.changed = store.apply_first_page(likes)
+
+                fresh = []
+                for track in tracks:
+                    if track.track_id in known:
+                        break
+                    fresh.append(track)
+                new.extend(fresh)
+                if not tracks or len(fresh) < len(tracks):
+                    break
+
+                offset = next_offset(likes)
+                if offset is None:
+                    # Walked to the very end, nothing older to page into
+                    store.set_meta("next_offset", END_OFFSET)
+        finally:
+            store.add(new)
+            stats.tracks = len(new)
+            stats.changed = stats.changed or bool(new)
+            full_walk = math.ceil((len(known) + len(new)) / self.page_size)
+            stats.requests_saved = max(0, full_walk - stats.pages)
+            total = int(store.get_meta("requests_saved", "0")) + stats.requests_saved
+            store.set_meta("requests_saved", str(total))
+            stats.finished = perf_counter()
+        return stats
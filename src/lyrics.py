@@ -0,0 +1,269 @@
+import json
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from time import time
+from cache import CACHE_DIR
+from karaoke import LyricTimeline
+from soundcloud import Track
+
+try:
+    import syncedlyrics
+except ImportError:
+    syncedlyrics = None
+
+#: Fetched lyrics, <track_id>.lrc or <track_id>.json
+LYRICS_DIR = CACHE_DIR / "lyrics"
+
+#: Lyrics formats by preference, also the file extensions
+LYRICS_FORMATS = ("lrc", "json")
+
+#: Seconds a track without lyrics isn't looked up again
+MISSING_TTL = 7 * 24 * 3600
+
+#: Concurrent lyrics lookups
+LYRICS_WORKERS = 2
+
+#: Parsed timelines kept in memory
+TIMELINE_CACHE_SIZE = 32
+
+LRC_TIME = re.compile(r"\[(\d+):(\d+(?:\.\d+)?)\]")
+LRC_OFFSET = re.compile(r"\[offset:\s*([+-]?\d+)\]", re.IGNORECASE)
+#: Per-word timestamps of enhanced LRC
+LRC_WORD_TIME = re.compile(r"<\d+:\d+(?:\.\d+)?>")
+
+
+def parse_lrc(text: str) -> LyricTimeline:
+    """Timeline of an LRC file; metadata tags are skipped, [offset:] is applied"""
+    offset = 0
+    lines = []
+    for raw in text.splitlines():
+        raw = raw.strip()
+        match = LRC_OFFSET.match(raw)
+        if match:
+            # A positive offset makes the lyrics come earlier
+            offset = int(match.group(1))
+            continue
+        stamps = []
+        while (match := LRC_TIME.match(raw)):
+            stamps.append(int(match.group(1)) * 60000 + round(float(match.group(2)) * 1000))
+            raw = raw[match.end():]
+        # One line may carry several timestamps (repeated chorus)
+        words = LRC_WORD_TIME.sub("", raw).strip()
+        lines.extend((max(0, stamp - offset), words) for stamp in stamps)
+    return LyricTimeline(lines)
+
+
+def parse_json(text: str) -> LyricTimeline:
+    """Timeline of the {"lyrics": {"lines": [{"startTimeMs", "words"}]}} format"""
+    lines = json.loads(text)["lyrics"]["lines"]
+    return LyricTimeline((int(line["startTimeMs"]), line["words"]) for line in lines)
+
+
+def parse_lyrics(text: str, format: str) -> LyricTimeline:
+    if format == "lrc":
+        return parse_lrc(text)
+    if format == "json":
+        return parse_json(text)
+    raise ValueError(f"Unknown lyrics format: {format}")
+
+
+class LyricsProvider:
+    """Source of synced lyrics"""
+
+    name = "provider"
+
+    def available(self) -> bool:
+        return True
+
+    def fetch(self, track: Track):
+        """
+        Look up the lyrics of a track.
+
+        Returns:
+            tuple: (text, format) with format in LYRICS_FORMATS, None if the provider has none.
+        """
+        raise NotImplementedError
+
+
+class LocalProvider(LyricsProvider):
+    """Lyrics files named after the track id in a directory, e.g. test fixtures"""
+
+    name = "local"
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def fetch(self, track: Track):
+        for format in LYRICS_FORMATS:
+            path = self.directory / f"{track.track_id}.{format}"
+            if path.exists():
+                return path.read_text(encoding="utf-8"), format
+        return None
+
+
+class SyncedLyricsProvider(LyricsProvider):
+    """LRC lyrics searched by title and author with the optional syncedlyrics package"""
+
+    name = "syncedlyrics"
+
+    def available(self) -> bool:
+        return syncedlyrics is not None
+
+    def fetch(self, track: Track):
+        if syncedlyrics is None:
+            return None
+        text = syncedlyrics.search(f"{track.title} {track.author}", synced_only=True)
+        return (text, "lrc") if text else None
+
+
+def default_providers() -> list:
+    return [SyncedLyricsProvider()]
+
+
+class LyricsService:
+    """
+    Lyrics of tracks, fetched once from the providers and kept on disk.
+
+    Providers are asked in order, the first hit is stored in its original
+    format under LYRICS_DIR. A track no provider knows is remembered in
+    missing.json and not looked up again for missing_ttl seconds. Lookups
+    run on a small thread pool and are shared while in flight. The last
+    parsed timelines stay in memory, so going back to a track doesn't read
+    and parse its file again.
+    """
+
+    def __init__(self, providers: list = None, directory=LYRICS_DIR, workers: int = LYRICS_WORKERS,
+                 missing_ttl: float = MISSING_TTL, cache_size: int = TIMELINE_CACHE_SIZE):
+        self.providers = default_providers() if providers is None else providers
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.missing_ttl = missing_ttl
+        self.missing_file = self.directory / "missing.json"
+        self.lock = Lock()
+        #: track_id (str) -> time of the lookup that found nothing
+        self.missing = self._read_missing()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lyrics")
+        #: track_id -> Future of a running lookup
+        self.pending = {}
+        self.cache_size = cache_size
+        #: track_id (str) -> LyricTimeline, least recently used first
+        self.timelines = OrderedDict()
+
+    def _read_missing(self) -> dict:
+        try:
+            with open(self.missing_file, "r") as f:
+                return dict(json.load(f))
+        except (OSError, ValueError):
+            return {}
+
+    def _save_missing(self) -> None:
+        tmp_file = self.missing_file.with_suffix(".part")
+        with open(tmp_file, "w") as f:
+            json.dump(self.missing, f)
+        os.replace(tmp_file, self.missing_file)
+
+    def path(self, track_id):
+        """Stored lyrics file of a track, None if there is none"""
+        for format in LYRICS_FORMATS:
+            path = self.directory / f"{track_id}.{format}"
+            if path.exists():
+                return path
+        return None
+
+    def is_missing(self, track_id) -> bool:
+        """True if a recent lookup found no lyrics for the track"""
+        with self.lock:
+            checked = self.missing.get(str(track_id))
+        return checked is not None and time() - checked < self.missing_ttl
+
+    def _remember(self, track_id, timeline: LyricTimeline) -> None:
+        with self.lock:
+            self.timelines[str(track_id)] = timeline
+            self.timelines.move_to_end(str(track_id))
+            while len(self.timelines) > self.cache_size:
+                self.timelines.popitem(last=False)
+
+    def cached(self, track_id):
+        """Timeline of stored lyrics without any network, None if not stored"""
+        with self.lock:
+            timeline = self.timelines.get(str(track_id))
+            if timeline is not None:
+                self.timelines.move_to_end(str(track_id))
+                return timeline
+        path = self.path(track_id)
+        if path is None:
+            return None
+        try:
+            timeline = parse_lyrics(path.read_text(encoding="utf-8"), path.suffix[1:])
+        except (OSError, ValueError, KeyError) as ex:
+            print(f"Broken lyrics {path}: {ex}")
+            path.unlink(missing_ok=True)
+            return None
+        self._remember(track_id, timeline)
+        return timeline
+
+    def get(self, track: Track):
+        """Timeline of a track's lyrics, asking the providers if needed; None if there are none"""
+        track_id = track.track_id
+        timeline = self.cached(track_id)
+        if timeline is not None or self.is_missing(track_id):
+            return timeline
+
+        failed = False
+        for provider in self.providers:
+            if not provider.available():
+                continue
+            try:
+                found = provider.fetch(track)
+            except Exception as ex:
+                print(f"Lyrics provider {provider.name} failed: {ex}")
+                failed = True
+                continue
+            if found is None:
+                continue
+            text, format = found
+            try:
+                timeline = parse_lyrics(text, format)
+            except (ValueError, KeyError) as ex:
+                print(f"Lyrics from {provider.name} unreadable: {ex}")
+                continue
+            if not len(timeline):
+                # Plain text without timestamps is no use for karaoke
+                continue
+            part_file = self.directory / f"{track_id}.{format}.part"
+            part_file.write_text(text, encoding="utf-8")
+            os.replace(part_file, self.directory / f"{track_id}.{format}")
+            self._remember(track_id, timeline)
+            return timeline
+
+        # Only a clean "not found" from a working provider is worth remembering
+        if not failed and any(provider.available() for provider in self.providers):
+            with self.lock:
+                self.missing[str(track_id)] = time()
+                self._save_missing()
+        return None
+
+    def fetch(self, track: Track):
+        """Look up a track in the background, returns a Future of get()"""
+        track_id = track.track_id
+        with self.lock:
+            future = self.pending.get(track_id)
+            if future is not None:
+                return future
+            future = self.pending[track_id] = self.pool.submit(self.get, track)
+        future.add_done_callback(lambda _: self._done(track_id))
+        return future
+
+    def _done(self, track_id) -> None:
+        with self.lock:
+            self.pending.pop(track_id, None)
+
+    def prefetch(self, tracks: list) -> None:
+        """Fetch the lyrics of upcoming tracks that aren't stored or known missing"""
+        for track in tracks:
+            if self.path(track.track_id) is None and not self.is_missing(track.track_id):
+                self.fetch(track)
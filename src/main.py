@@ -1,18 +1,26 @@
-from typing import List, Tuple
+from typing import List
 import os
-import ffmpeg
-from time import sleep
 from pathlib import Path
 import json
-from soundcloud import Soundcloud
+from soundcloud import AsyncSoundcloud, Track, next_offset, parse_likes
+from downloader import (
+    DownloadService,
+    FirstAudioMeter,
+    PLAY_NOW,
+    PROGRESSIVE,
+    resolve_track,
+)
+from cache import AudioCache
+from library import LibrarySync, LibraryStore, END_OFFSET, track_index
 import flet
-from typing import Dict
-import eyed3
 import traceback
-from playerctl import PlayerCtl
-import vlc
+from player import create_player
+from updates import UpdateScheduler
+from virtual_list import ListWindow
+from karaoke import LyricTimeline
+from lyrics import LyricsService
+from artwork import ArtworkCache, THUMBNAIL, COVER
 import asyncio
-#TODO Add syncedlyrics and pylrc
 
 from flet.core.scrollable_control import OnScrollEvent
 from flet.core.animation import AnimationCurve
@@ -33,6 +41,7 @@ from flet import (
     Theme,
     AlertDialog,
     Padding,
+    Margin,
     ThemeMode,
     ScrollMode,
     alignment,
@@ -42,9 +51,18 @@ from flet import (
     MainAxisAlignment,
     CrossAxisAlignment,
     Button,
+    SnackBar,
 )
 
 
+
+#: Height of a track row plus the gap below it, in px
+ROW_EXTENT = 85
+
+#: Lyric lines shown above and below the active one
+KARAOKE_WINDOW = 6
+
+
 class SoundCloudPlayerApp:
     def __init__(self, page):
         if not os.path.isdir(f"{Path.home()}/.soundcloud"):
@@ -54,28 +72,55 @@ class SoundCloudPlayerApp:
         self.offset = 0
         self.duration = 0
         self.loading = False
+        # A full library sync runs apart from lazy paging, playback goes on meanwhile
+        self.syncing = False
         self.lock_seek = False
         self.indexl = 0
         self.have_karaoke = False
         self.show_karaoke = False
         self.focused_line = None
+        # Lyric lines that have a Text in the karaoke column, None to rebuild them
+        self.karaoke_lines = None
 
         # Initialize variables
         self.page = page
-        self.download = False
-        self.liked_tracks: List[Tuple[str, str, str, str, int, str]] = []
-        self.karaoke: Dict[int, str]
-        self.client = Soundcloud("", "AsIBxSC4kw4QXdGp0vufY0YztIlkRMUc")
+        # Every page update goes through the scheduler, coalesced per frame
+        self.ui = UpdateScheduler(page)
+        self.download_job = None
+        self.liked_tracks: List[Track] = []
+        self.karaoke: LyricTimeline
+        self.client = AsyncSoundcloud("", "AsIBxSC4kw4QXdGp0vufY0YztIlkRMUc")
+        self.library = LibraryStore()
+        self.cache = AudioCache()
+        # Drop truncated or corrupt files left by a crash, they are downloaded again
+        print(f"Cache validation: {self.cache.validate(self.library.durations())}")
+        self.downloads = DownloadService(self.client.client, self.cache, store=self.library)
+        self.downloads.subscribe(self.on_download_event)
+        self.progressive = PROGRESSIVE
+        self.first_audio = FirstAudioMeter()
+        self.lyrics = LyricsService()
+        # Covers are downloaded once and shown from disk
+        self.artwork = ArtworkCache()
 
         # Audio component
-        self.audio_player = PlayerCtl() #pyright:ignore
+        self.audio_player = create_player()
+        # Index of the track handed to the player for a gapless start
+        self.queued = None
 
         # Initialize UI
         self.setup_controls()
 
     def setup_controls(self):
         """Setup UI elements"""
-        self.track_list = Column(spacing=10)
+        # Only the rows around the viewport exist, the rest of the list is two spacers.
+        self.list_window = ListWindow(ROW_EXTENT)
+        self.rows = range(0)
+        self.row_pool: List[Container] = []
+        self.scroll_offset = 0
+        self.viewport = self.page.height or 800
+        self.top_spacer = Container(height=0)
+        self.bottom_spacer = Container(height=0)
+        self.track_list = Column([self.top_spacer, self.bottom_spacer], spacing=0)
 
         # Volume slider
         self.volume_slider = Slider(
@@ -92,6 +137,18 @@ class SoundCloudPlayerApp:
             Icons.SHORT_TEXT_ROUNDED, on_click=self.enable_karaoke
         )
 
+        self.sync_button = IconButton(
+            Icons.SYNC_ROUNDED,
+            tooltip="Sync library",
+            on_click=self.sync_library,
+        )
+
+        self.cache_button = IconButton(
+            Icons.STORAGE_ROUNDED,
+            tooltip="Cache stats",
+            on_click=self.show_cache_stats,
+        )
+
         self.play_button = IconButton(
             icon=Icons.PLAY_ARROW_ROUNDED,
             disabled=True,
@@ -103,7 +160,7 @@ class SoundCloudPlayerApp:
         )
 
         self.next_button = IconButton(
-            Icons.SKIP_NEXT_ROUNDED, on_click=lambda x: self.play_next()
+            Icons.SKIP_NEXT_ROUNDED, on_click=lambda x: self.page.run_task(self.play_next)
         )
 
         # Progress bar
@@ -133,7 +190,7 @@ class SoundCloudPlayerApp:
         # Cover image
         self.volume_icon = Icon(Icons.VOLUME_UP_ROUNDED)
         self.cover_image = Image(
-            src="https://via.placeholder.com/500",
+            src=str(self.artwork.placeholder),
             width=150,
             height=150,
             fit=ImageFit.CONTAIN,
@@ -186,7 +243,13 @@ class SoundCloudPlayerApp:
                     spacing=5,
                 ),
                 Row(
-                    [self.volume_icon, self.volume_slider, self.karaoke_button]
+                    [
+                        self.volume_icon,
+                        self.volume_slider,
+                        self.karaoke_button,
+                        self.sync_button,
+                        self.cache_button,
+                    ]
                 ),
             ],
             alignment=MainAxisAlignment.SPACE_BETWEEN,
@@ -223,17 +286,18 @@ class SoundCloudPlayerApp:
                 expand=True,
             ),
         )
-        # Karaoke text column
+        # Karaoke text column, only the lines around the active one get a Text.
         self.karaoke_column = Column(
-            [Text("", size=20, key=f"{i}") for i in range(100)],
+            [],
             height=self.page.height - 20,
             scroll=ScrollMode.HIDDEN,
             horizontal_alignment=CrossAxisAlignment.CENTER,
             alignment=MainAxisAlignment.CENTER,
         )
         self.page.on_resized = self.adaptive
-        self.page.run_task(self.position_change)
-        self.load_likes(None)
+        # The progress bar, karaoke and track changes follow the player events.
+        self.audio_player.subscribe(self.on_player_event)
+        self.page.run_task(self.load_library)
 
     def adaptive(self, e):
         self.karaoke_column.height = self.page.height - 20
@@ -242,12 +306,16 @@ class SoundCloudPlayerApp:
         if self.right_panel.content == self.track_column:
             self.show_karaoke = True
             self.right_panel.content = self.karaoke_column
+            # The active line wasn't followed while the panel was hidden.
+            if self.have_karaoke:
+                self.focused_line = self.karaoke.line_at(self.audio_player.get_position())
+            self.karaoke_lines = None
+            self.render_karaoke()
         else:
             self.show_karaoke = False
             self.right_panel.content = self.track_column
 
-        self.page.update()
-        self.page.update()
+        self.ui.update()
 
     def change_theme(self, e):
         """Change theme"""
@@ -257,18 +325,15 @@ class SoundCloudPlayerApp:
         else:
             self.theme_button.icon = Icons.NIGHTLIGHT_SHARP
             self.page.theme_mode = ThemeMode.DARK
-        self.page.update()
+        self.ui.update()
 
-    def play_prev(self, e):
+    async def play_prev(self, e):
         """Play prev track"""
         if (
             self.audio_player.get_position() * self.duration < 5
             and self.indexl != 0
         ):
-            self.play_track(
-                *self.liked_tracks[self.indexl - 1],
-                self.indexl - 1,
-            )
+            await self.play_track(self.indexl - 1)
         else:
             self.audio_player.seek(0) #pyright:ignore
 
@@ -285,7 +350,7 @@ class SoundCloudPlayerApp:
         progress_ratio = max(0, min(click_position / 230, 1))  # Normalize
         self.time_line.value = f"{self.format_ms(int(progress_ratio * duration))}/{self.format_ms(self.duration)}"
         self.progress_bar.value = progress_ratio
-        self.page.update()
+        self.ui.update()
 
     def seek_end(self, e):
         """On tap on timeline end"""
@@ -296,73 +361,112 @@ class SoundCloudPlayerApp:
         self.lock_seek = False
         if self.play_button.icon == Icons.PAUSE_ROUNDED:
             self.audio_player.play()
-        self.page.update()
-
-    def load_karaoke(self, track_id: int):
-        karaoke = dict()
-        self.karaoke_column.controls = []
-        with open(
-            f"{Path.home()}/.soundcloud/lyrics/{track_id}.json", "r"
-        ) as f:
-            text = json.loads(f.readline())["lyrics"]["lines"]
-            for j, line in enumerate(text):
-                start_time = int(line["startTimeMs"])
-                karaoke[start_time] = j
-                self.karaoke_column.controls.append(
-                    Text(
-                        line["words"],
-                        size=20,
-                        opacity=0.6,
-                        key=str(start_time),
-                        animate_opacity=500,
-                    )
-                )
+        self.ui.update()
+
+    def load_karaoke(self, timeline: LyricTimeline):
+        """Use a lyrics timeline for the karaoke column"""
+        self.karaoke = timeline
+        self.focused_line = None
         self.have_karaoke = True
-        self.karaoke = karaoke
+        self.karaoke_lines = None
+        self.render_karaoke()
+
+    def karaoke_text(self, line: int) -> Text:
+        """The Text of a lyric line, styled as active if it is the focused one"""
+        active = line == self.focused_line
+        return Text(
+            self.karaoke.words[line],
+            size=30 if active else 20,
+            opacity=1 if active else 0.6,
+            # Lines are keyed by index: start times of a mix may repeat.
+            key=str(line),
+            animate_opacity=500,
+            text_align=TextAlign.CENTER,
+        )
 
-    def lazy_load(self, e: OnScrollEvent):
+    def karaoke_window(self) -> range:
+        """Lines within KARAOKE_WINDOW of the focused one"""
+        total = len(self.karaoke) if self.have_karaoke else 0
+        # Before the first line the window starts at the top of the lyrics.
+        center = -1 if self.focused_line is None else self.focused_line
+        start = max(0, center - KARAOKE_WINDOW)
+        return range(min(start, total), min(total, center + KARAOKE_WINDOW + 1))
+
+    def render_karaoke(self, previous: (int | None) = None):
+        """
+        Keep a Text for each line around the focused one.
+
+        Lines are only added or removed at the edges of the window, and
+        only the previous and the new active line are restyled.
+        """
+        if not self.show_karaoke:
+            # Nothing is built or updated for a hidden panel.
+            self.karaoke_lines = None
+            return
+        lines = self.karaoke_window()
+        old = self.karaoke_lines
+        controls = self.karaoke_column.controls
+        if old is None or lines.start >= old.stop or lines.stop <= old.start:
+            # Nothing to keep (new lyrics, a long seek or the panel was hidden).
+            self.karaoke_column.controls = [self.karaoke_text(line) for line in lines]
+            moved = True
+        else:
+            moved = lines != old
+            # Drop the lines that left the window, then add the ones that entered it.
+            del controls[: max(0, lines.start - old.start)]
+            if old.stop > lines.stop:
+                del controls[lines.stop - old.stop:]
+            controls[:0] = [self.karaoke_text(line) for line in range(lines.start, old.start)]
+            controls.extend(self.karaoke_text(line) for line in range(old.stop, lines.stop))
+            kept = range(max(lines.start, old.start), min(lines.stop, old.stop))
+            for line, active in ((previous, False), (self.focused_line, True)):
+                if line is not None and line in kept:
+                    self.ui.set(
+                        controls[line - lines.start],
+                        size=30 if active else 20,
+                        opacity=1 if active else 0.6,
+                    )
+        self.karaoke_lines = lines
+        if moved:
+            self.ui.update(self.karaoke_column)
+
+    async def fetch_karaoke(self, track: Track):
+        """Look the lyrics of the playing track up in background"""
+        timeline = await asyncio.wrap_future(self.lyrics.fetch(track))
+        # Show them only if the track is still playing.
+        if timeline is not None and self.liked_tracks[self.indexl].track_id == track.track_id:
+            self.load_karaoke(timeline)
+
+    async def lazy_load(self, e: OnScrollEvent):
         """Lazy load tracks"""
         data = json.loads(e.data)
-        if self.loading:
+        self.scroll_offset = data["p"]
+        self.viewport = data["vd"]
+        self.render_rows()
+        if self.loading or self.syncing:
             return
         if self.offset == -1:
             return
         if data["maxse"] - data["p"] < 100:
             self.loading = True
-            self.load_likes(None, offset=str(self.offset))
+            await self.load_likes(None, offset=str(self.offset))
             self.loading = False
 
-    def download_mp3(self, url: str, output_file: str, title: str, artist: str):
-        """
-        Download a track from the given stream URL.
-
-        Args:
-            url (str): The streaming URL of the audio track.
-            output_file (str): The file path where the downloaded MP3 will be saved.
-        """
-        try:
-            # Pause the audio player to avoid conflicts during download.
-            self.audio_player.pause()
-
-            # Set the download flag to True and reset the progress bar value.
-            self.download = True
-            self.progress_bar.value = None
-
-            # Apply UI updates to reflect the download process.
-            self.page.update()
-
-            # Use ffmpeg to download and convert the stream to an MP3 file.
-            ffmpeg.input(url).output(output_file, format="mp3").run()
-            tags = eyed3.load(output_file)
-            tags.tag.title = title #pyright:ignore
-            tags.tag.artist = artist #pyright:ignore
-            tags.tag.save() #pyright:ignore
-            # Reset the progress bar and download flag after the process completes.
+    def on_download_event(self, job, event: str):
+        """Show download progress of the selected track in the progress bar"""
+        if event == "done" and self.queued is None:
+            # The prefetch of the next track may have just finished.
+            self.queue_gapless()
+        if job is not self.download_job:
+            return
+        if event in ("started", "progress"):
+            # None makes the bar indeterminate while the size is unknown.
+            self.progress_bar.value = job.progress
+        elif event in ("done", "failed", "cancelled"):
             self.progress_bar.value = 0
-            self.download = False
-        except Exception as e:
-            # Print an error message to the console if an exception occurs.
-            print(f"An error occurred: {e}")
+        else:
+            return
+        self.ui.update()
 
     def not_none(self, val: (int | None)) -> int:
         """Return int not None if none return 0"""
@@ -384,250 +488,369 @@ class SoundCloudPlayerApp:
             ],
         )
         self.page.dialog.open = True
-        self.page.update()
+        self.ui.update()
 
-    def play_track(self, title, url, auth, artwork_url, track_id, author, ind):
+    async def play_track(self, ind, queued=False):
         """
         Play a track.
 
         Args:
-            title (str): The title of the track.
-            url (str): The streaming URL of the track.
-            auth (str): Authorization credentials for the streaming service.
-            artwork_url (str): The URL of the track's artwork.
-            track_id (str): Unique identifier for the track.
-            author (str): Name of the track's author.
             ind (int): Index of the track in the track list.
+            queued (bool): The player already started the track from its queue, only the UI follows.
         """
 
-        # Reset the background color of the previously selected track.
-        self.track_list.controls[self.indexl].bgcolor = Colors.SURFACE #pyright:ignore
-
         # Update the index of the currently selected track.
         self.indexl = ind
+        track = self.liked_tracks[ind]
+        title, track_id, artwork_url = track.title, track.track_id, track.artwork_url
 
         # Update the displayed track details: author, title, and artwork.
-        self.track_author.value = author
+        self.track_author.value = track.author
         self.track_title.value = title
-        self.cover_image.src = artwork_url or "https://via.placeholder.com/500"
+        self.cover_image.data = artwork_url
+        self.cover_image.src = self.artwork.get(artwork_url, COVER, lambda path: self.show_artwork(self.cover_image, artwork_url, path))
 
         # Highlight the selected track in the track list.
-        self.track_list.controls[ind].bgcolor = Colors.with_opacity(
-            0.5, Colors.SURFACE_TINT
-        )
+        self.render_rows(force=True)
 
         try:
-            # Check if the track is already downloaded locally.
-            if not os.path.isfile(f"{Path.home()}/.soundcloud/{track_id}.mp3"):
-                # Attempt to fetch the stream URL until it succeeds.
-                while True:
-                    try:
-                        url = self.client.get_stream(url, auth)["url"]
-                    except KeyError:
-                        print("Wait 0.1s")
-                        sleep(0.1)  # Retry after a short delay.
+            if not queued:
+                self.first_audio.start(track_id)
+                stream_url = self.cache.lookup(track_id)
+                self.cache.played(track_id)
+
+                # Check if the track is already downloaded locally.
+                if stream_url is None:
+                    if self.progressive:
+                        # Resolve the stream URL, refreshing a stale stored authorization.
+                        url = await asyncio.to_thread(resolve_track, self.client.client, track, self.library)
+
+                        # Play straight from the stream, the cache file is written in parallel
+                        # (a prefetch of this track already in flight is reused).
+                        self.downloads.submit(track, PLAY_NOW, stream_url=url)
+                        stream_url = url
                     else:
-                        break
-
-                # Download the track to the local cache directory.
-                self.download_mp3(
-                    url, f"{Path.home()}/.soundcloud/{track_id}.mp3", title, author
-                )
-
-            # Set the local file path as the audio source for the player.
-            stream_url = f"{Path.home()}/.soundcloud/{track_id}.mp3"
-            self.audio_player.set_media(stream_url)
+                        # Pause the audio player to avoid conflicts during download.
+                        self.audio_player.pause()
+
+                        # Download the track ahead of any prefetch, progress goes to the progress bar.
+                        self.download_job = self.downloads.submit(track, PLAY_NOW)
+                        self.progress_bar.value = None
+                        self.ui.update()
+                        stream_url = await asyncio.to_thread(self.download_job.wait)
+                        if stream_url is None:
+                            raise RuntimeError(f"Download of {title} failed")
+
+                # Set the local file (or the stream) as the audio source for the player.
+                self.audio_player.set_media(str(stream_url))
+                self.queued = None
+            else:
+                self.cache.played(track_id)
 
             # Update the play button state and icon to indicate playback.
             self.play_button.disabled = False
             self.play_button.icon = Icons.PAUSE_ROUNDED
 
-            # Load karaoke
+            # Load karaoke: stored lyrics right away, otherwise look them up
+            # unless a recent lookup found none.
             self.have_karaoke = False
-            if os.path.isfile(
-                f"{Path.home()}/.soundcloud/lyrics/{track_id}.json"
-            ):
-                self.load_karaoke(track_id)
+            self.focused_line = None
+            self.karaoke_lines = None
+            self.render_karaoke()
+            timeline = self.lyrics.cached(track_id)
+            if timeline is not None:
+                self.load_karaoke(timeline)
+            elif not self.lyrics.is_missing(track_id):
+                self.page.run_task(self.fetch_karaoke, track)
 
             # Start playing the track.
-            self.audio_player.play()
+            if not queued:
+                self.audio_player.play()
             # Apply UI updates to the page.
-            self.page.update()
+            self.ui.update()
+
+            # Pre-download the next tracks so skipping to them is instant.
+            upcoming = self.liked_tracks[ind + 1 : ind + 1 + self.downloads.depth]
+            # Keep the queue in the cache whatever the eviction policy says.
+            self.cache.pin([track_id] + [track.track_id for track in upcoming])
+            self.downloads.prefetch(upcoming)
+            # Lyrics of the next tracks are fetched alongside their audio.
+            self.lyrics.prefetch(upcoming)
+            self.queue_gapless()
 
         except Exception:
             # Display an error message if something goes wrong.
             self.show_error(str(traceback.format_exc()))
 
-    def play_next(self):
-        """Play next track"""
-        if self.loading:
+    def queue_gapless(self):
+        """Hand the next track to the player once it is cached, so it starts without a gap"""
+        ind = self.indexl + 1
+        if ind >= len(self.liked_tracks) or self.queued == ind:
             return
+        path = self.cache.get(self.liked_tracks[ind].track_id)
+        if path is not None and self.audio_player.queue_next(str(path)):
+            self.queued = ind
 
+    async def play_next(self):
+        """Play next track"""
         if self.indexl == len(self.liked_tracks) - 1:
+            # More tracks are already on their way.
+            if self.loading or self.syncing:
+                return
             self.loading = True
-            self.load_likes(None, offset=str(self.offset))
+            await self.load_likes(None, offset=str(self.offset))
             self.loading = False
         else:
-            self.play_track(
-                *self.liked_tracks[self.indexl + 1],
-                self.indexl + 1,
+            await self.play_track(self.indexl + 1)
+
+    def focus_line(self, line: (int | None)):
+        """Highlight a lyric line and scroll it into view"""
+        previous, self.focused_line = self.focused_line, line
+        self.render_karaoke(previous)
+        if line is not None and self.show_karaoke:
+            self.karaoke_column.scroll_to(
+                key=str(line),
+                duration=300,
+                curve=AnimationCurve.EASE_IN_OUT_EXPO,
             )
 
-    def focus_line(self, text: Text):
-        for k in self.karaoke_column.controls:
-            k.opacity = 0.6
-            k.size = 20 #pyright:ignore
-        text.opacity = 1
-        text.size = 30
-        self.page.update()
+    def on_player_event(self, event: str, value):
+        """Follow the player state, called from the player's dispatch thread."""
+        try:
+            if event == "ready":
+                print("Player not ready" if value is None else f"Player ready in {value:.2f}s")
+            elif event == "state":
+                if value == "Playing" and self.first_audio.requested is not None:
+                    print(f"Time to first audio: {self.first_audio.playing():.2f}s")
+            elif event == "next":
+                # The player moved on to the queued track by itself.
+                if self.queued is not None:
+                    ind, self.queued = self.queued, None
+                    self.page.run_task(self.play_track, ind, True)
+            elif event == "end":
+                # An end reported while the next track is being requested is stale.
+                if not self.first_audio.waiting():
+                    self.page.run_task(self.play_next)
+            elif event == "position":
+                self.position_change(*value)
+        except Exception:
+            print(traceback.format_exc())
 
-    async def position_change(self):
+    def position_change(self, pos_time: int, duration: int):
         """Update duration display."""
-        while True:
-            self.duration = self.audio_player.get_length()
-            if self.duration < 0:
-                self.duration = 0
-            await asyncio.sleep(0.1)
-            try:
-                if self.lock_seek:
-                    continue
-                if self.download:
-                    self.progress_bar.value = None
-                    self.page.update()
-                    continue
-                pos_time = self.audio_player.get_position()
-                self.time_line.value = f"{self.format_ms(pos_time)}/{self.format_ms(self.duration)}"
-                if (
-                    self.audio_player.get_status() == 'Stopped'
-
-                ):
-                    self.play_next()
-                    continue
-                if self.duration == 0:
-                    self.progress_bar.value = 0
-                else:
-                    self.progress_bar.value = max(
-                        0,
-                        pos_time / self.not_none(self.duration),
-                    )
-                if self.have_karaoke and self.show_karaoke:
-                    pos = min(self.karaoke, key=lambda x: abs(x - pos_time))
-
-                    if pos - pos_time < 100 and self.focused_line != pos:
-                        self.focused_line = pos
-                        self.focus_line(
-                            self.karaoke_column.controls[self.karaoke[pos]] #pyright:ignore
-                        )
-                        self.karaoke_column.scroll_to(
-                            key=str(pos),
-                            duration=300,
-                            curve=AnimationCurve.EASE_IN_OUT_EXPO,
-                        )
-                self.page.update()
-            except Exception:
-                print(traceback.format_exc())
+        self.duration = max(0, duration)
+        if self.lock_seek:
+            return
+        if self.download_job is not None and not self.download_job.done:
+            # The progress bar follows the download events meanwhile.
+            return
+        # Controls that already show these values aren't sent again.
+        self.ui.set(
+            self.time_line,
+            value=f"{self.format_ms(pos_time)}/{self.format_ms(self.duration)}",
+        )
+        if self.duration == 0:
+            progress = 0
+        else:
+            # Finer steps than a pixel of the bar aren't visible.
+            progress = round(max(0, pos_time / self.not_none(self.duration)), 3)
+        self.ui.set(self.progress_bar, value=progress)
+        if self.have_karaoke and self.show_karaoke:
+            line = self.karaoke.line_at(pos_time)
+            if line != self.focused_line:
+                # Seeking before the first line just clears the highlight.
+                self.focus_line(line)
 
     def format_ms(self, time):
         curr_seconds = time // 1000
         curr_minutes = curr_seconds // 60
         return f"{str(curr_minutes).zfill(2)}:{str(curr_seconds%60).zfill(2)}"
 
-    def load_likes(self, e, offset: str = "0"):
+    async def load_library(self):
+        """Show the stored library, then apply changes from the first likes page"""
+        tracks = self.library.tracks()
+        if not tracks:
+            await self.load_likes(None)
+            return
+
+        # Serve the list straight from disk and continue paging where we stopped.
+        self.add_tracks(tracks)
+        offset = self.library.get_meta("next_offset", "0")
+        self.offset = -1 if offset == END_OFFSET else offset
+        self.ui.update()
+
+        try:
+            # Fetch only what's new since the last launch.
+            stats = await LibrarySync(self.client, page_size=24).delta(self.library)
+            self.sync_button.tooltip = f"Sync library ({stats.requests_saved} requests saved)"
+            print(f"Library delta sync: {stats}")
+            if stats.changed:
+                # Something was liked or unliked since the last launch: rebuild the list.
+                self.reload_tracks()
+                self.ui.update()
+        except Exception as ex:
+            # Offline: keep showing the stored library.
+            print(f"Library refresh failed: {ex}")
+
+    def reload_tracks(self):
+        """Rebuild the track list from the library, following the playing and the queued track"""
+        # The play button is enabled once a track has been played.
+        playing = None if self.play_button.disabled else self.liked_tracks[self.indexl].track_id
+        queued = None if self.queued is None else self.liked_tracks[self.queued].track_id
+        self.liked_tracks.clear()
+        self.add_tracks(self.library.tracks())
+        found = track_index(self.liked_tracks, playing)
+        self.indexl = 0 if found is None else found
+        # The queued track is only right if it still follows the playing one.
+        if queued is None or track_index(self.liked_tracks, queued) != self.indexl + 1:
+            self.queued = None
+            if found is not None:
+                self.queue_gapless()
+        else:
+            self.queued = self.indexl + 1
+        self.render_rows(force=True)
+
+    async def load_likes(self, e, offset: str = "0"):
         """Loads liked tracks from SoundCloud"""
         try:
             # Fetch the liked tracks from SoundCloud with a limit of 24 items and starting at the provided offset.
-            likes = self.client.get_likes(limit=24, offset=offset)
+            likes = await self.client.get_likes(limit=24, offset=offset)
 
             # If no liked tracks are found, set the offset to -1 and return.
             if not likes["collection"]:
                 self.offset = -1
+                self.library.set_meta("next_offset", END_OFFSET)
                 return
 
             # Extract the next offset from the response to allow pagination for subsequent requests.
-            offset = likes["next_href"]
-            self.offset = offset[offset.index("?") + 8 : offset.index("&")]
-
-            # Iterate through the liked tracks in the collection.
-            for i, item in enumerate(likes["collection"]):
-                # Skip items that are playlists (we are interested in tracks only).
-                if "playlist" in item:
-                    return
-
-                # Extract track details such as title, media URL, artwork, and author.
-                track = item["track"]
-                title = track["title"]
-                media_url = track["media"]["transcodings"][0][
-                    "url"
-                ]  # The streaming URL of the track.
-                track_auth = track.get(
-                    "track_authorization"
-                )  # The track's authorization credentials (if any).
-                artwork_url = (
-                    track.get("artwork_url").replace("large", "t500x500")
-                    if track.get("artwork_url")
-                    else "https://via.placeholder.com/150"  # Default artwork if none is available.
-                )
-                author = track["user"]["username"]  # The author's username.
-                track_id = item["track"]["id"]  # The track's unique ID.
-
-                # Add the track to the list of liked tracks (used later for playback).
-                self.liked_tracks.append(
-                    (
-                        title,
-                        media_url,
-                        track_auth,
-                        artwork_url,
-                        track_id,
-                        author,
-                    )
-                )
+            offset = next_offset(likes)
+            self.offset = -1 if offset is None else offset
 
-                # Define a handler for when the user clicks on a track. This will trigger the playback of the track.
-                def handle_click(
-                    event,
-                    t=title,  # Default values for the track's title, media URL, etc.
-                    u=media_url,
-                    a=track_auth,
-                    art=artwork_url,
-                    ind=i,  # Index of the track in the list.
-                    tr_id=track_id,
-                    authr=author,
-                ):
-                    self.play_track(
-                        t, u, a, art, tr_id, authr, ind
-                    )  # Call the play_track method with track info.
-
-                # Create a visual representation of the track in the UI with artwork, title, and author.
-                self.track_list.controls.append(
-                    Container(
-                        content=Row(
-                            [
-                                Image(
-                                    src=artwork_url, border_radius=15
-                                ),  # Display the track's artwork.
-                                ListTile(
-                                    title=Text(
-                                        title, max_lines=1
-                                    ),  # Display the track's title.
-                                    subtitle=Text(
-                                        author, max_lines=1
-                                    ),  # Display the track's author.
-                                ),
-                            ],
-                            height=75,  # Set the height for the track item.
-                        ),
-                        border_radius=15,  # Round the corners of the container.
-                        bgcolor=Colors.SURFACE,  # Set the background color of the track item.
-                        on_click=handle_click,  # Attach the click handler to the track item.
-                    )
-                )
+            # Remember the page locally so the next launch doesn't download it again.
+            tracks = parse_likes(likes)
+            self.library.add(tracks)
+            self.library.set_meta("next_offset", str(self.offset))
+
+            self.add_tracks(tracks)
 
         except Exception as ex:
             # In case of any error (e.g., network issues or parsing errors), display an error message.
             self.show_error(str(ex))
 
         # Update the page to reflect the changes made to the track list.
-        self.page.update()
+        self.ui.update()
+
+    def add_tracks(self, tracks: List[Track]):
+        """Append liked tracks to the track list"""
+        self.liked_tracks.extend(tracks)
+
+        # Show the new tracks if they are in the viewport.
+        self.render_rows(force=True)
+
+    def make_row(self) -> Container:
+        """An empty track row for the pool, bound to a track by bind_row"""
+        return Container(
+            content=Row(
+                [
+                    Image(src="", border_radius=15),  # The track's artwork.
+                    ListTile(
+                        title=Text("", max_lines=1),  # The track's title.
+                        subtitle=Text("", max_lines=1),  # The track's author.
+                    ),
+                ],
+                height=75,  # Set the height for the track item.
+            ),
+            margin=Margin(0, 0, 0, ROW_EXTENT - 75),  # The gap to the next row.
+            border_radius=15,  # Round the corners of the container.
+            bgcolor=Colors.SURFACE,
+            on_click=self.handle_click,  # Play the track the row shows.
+        )
+
+    def bind_row(self, row: Container, ind: int):
+        """Show the track at index ind in a pooled row"""
+        track = self.liked_tracks[ind]
+        artwork_url = track.artwork_url
+        image, tile = row.content.controls #pyright:ignore
+        # The thumbnail from disk, or the placeholder until it's downloaded.
+        image.data = artwork_url
+        image.src = self.artwork.get(artwork_url, THUMBNAIL, lambda path: self.show_artwork(image, artwork_url, path))
+        tile.title.value = track.title
+        tile.subtitle.value = track.author
+        row.data = ind
+        row.visible = True
+        # Highlight the selected track.
+        row.bgcolor = (
+            Colors.with_opacity(0.5, Colors.SURFACE_TINT) if ind == self.indexl else Colors.SURFACE
+        )
+
+    def show_artwork(self, image: Image, artwork_url: str, path: str):
+        """Swap in a downloaded cover, unless the image shows another track by now"""
+        if image.data == artwork_url:
+            self.ui.set(image, src=path)
+
+    def render_rows(self, force: bool = False):
+        """Rebind the row pool to the tracks around the viewport"""
+        total = len(self.liked_tracks)
+        rows = self.list_window.visible(self.scroll_offset, self.viewport, total)
+        if rows == self.rows and not force:
+            return
+        self.rows = rows
+
+        # The pool grows to the largest window seen and is recycled from then on.
+        while len(self.row_pool) < len(rows):
+            row = self.make_row()
+            self.row_pool.append(row)
+            self.track_list.controls.insert(len(self.row_pool), row)
+        for row, ind in zip(self.row_pool, rows):
+            self.bind_row(row, ind)
+        for row in self.row_pool[len(rows):]:
+            row.visible = False
+
+        self.top_spacer.height, self.bottom_spacer.height = self.list_window.spacers(rows, total)
+        self.ui.update(self.track_list)
+
+    async def handle_click(self, e):
+        """Play the track of the clicked row"""
+        ind = e.control.data
+        await self.play_track(ind)
+
+    async def sync_library(self, e):
+        """Load the rest of the liked tracks in background"""
+        if self.loading or self.syncing or self.offset == -1:
+            return
+        self.syncing = True
+        self.sync_button.disabled = True
+        self.ui.update()
+
+        def on_page(likes):
+            tracks = parse_likes(likes)
+            self.library.add(tracks)
+            # Move the cursor with every stored page, so an interrupted sync resumes here.
+            offset = next_offset(likes)
+            self.offset = -1 if offset is None else offset
+            self.library.set_meta("next_offset", END_OFFSET if offset is None else offset)
+            self.add_tracks(tracks)
+            self.ui.update()
+
+        try:
+            stats = await LibrarySync(self.client).run(
+                on_page, offset=str(self.offset)
+            )
+            self.offset = -1
+            self.library.set_meta("next_offset", END_OFFSET)
+            self.page.open(SnackBar(Text(f"Library synced: {stats}")))
+        except Exception as ex:
+            self.show_error(str(ex))
+        finally:
+            self.syncing = False
+            self.sync_button.disabled = False
+            self.ui.update()
+
+    def show_cache_stats(self, e):
+        """Show audio cache stats"""
+        self.page.open(
+            SnackBar(Text(f"Cache: {self.cache.report()}\nUI updates: {self.ui.report()}"))
+        )
 
     def toggle_play(self, e):
         """Toggle play/pause."""
@@ -637,12 +860,12 @@ class SoundCloudPlayerApp:
         else:
             self.audio_player.play()  # Использование VLC для продолжения воспроизведения
             self.play_button.icon = Icons.PAUSE_ROUNDED
-        self.page.update()
+        self.ui.update()
 
     def change_volume(self, e):
         """Change volume."""
         value = int(e.control.value)
-        self.audio_player.audio_set_volume(value)
+        self.audio_player.set_volume(value)
         if value == 0:
             self.volume_icon.name = Icons.VOLUME_OFF_ROUNDED
         elif value < 50:
@@ -650,7 +873,7 @@ class SoundCloudPlayerApp:
         elif value > 50:
             self.volume_icon.name = Icons.VOLUME_UP_ROUNDED
 
-        self.page.update()
+        self.ui.update()
 
 
 # Main
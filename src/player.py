@@ -0,0 +1,244 @@
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from time import monotonic, perf_counter
+import vlc
+
+#: Position events per second while playing, 0 turns them off
+POSITION_RATE = 10
+
+#: "vlc" plays in-process, "mpris" controls a separate VLC over D-Bus
+PLAYER_BACKEND = "vlc"
+
+
+class EventPlayer:
+    """
+    Base of players that push their state instead of being polled.
+
+    Subscribers are called as callback(event, value):
+        "state"    -- "Playing", "Paused" or "Stopped"
+        "end"      -- None, the media played to its end and nothing was queued
+        "next"     -- url of the queued media that took over without a gap
+        "position" -- (position, length) in ms, position_rate times a second while playing
+        "ready"    -- seconds the player took to accept commands, None if it never did;
+                      a late subscriber still gets it once
+
+    Backends post events from their own threads (libvlc callbacks, D-Bus
+    signals). One dispatch thread delivers them, so a subscriber may call
+    back into the player, and it sleeps while nothing is playing.
+    """
+
+    def __init__(self, position_rate: float = POSITION_RATE):
+        self.position_rate = position_rate
+        self.subscribers = []
+        self.subscribers_lock = Lock()
+        self.status = "Stopped"
+        self.events = Queue()
+        #: Set once startup is over, ready_latency stays None if it failed
+        self.ready = Event()
+        self.ready_latency = None
+        self.created = perf_counter()
+        Thread(target=self._dispatch, daemon=True).start()
+
+    def subscribe(self, callback) -> None:
+        with self.subscribers_lock:
+            self.subscribers.append(callback)
+            if self.ready.is_set():
+                self.events.put(("ready", self.ready_latency, [callback]))
+
+    def _post(self, event: str, value=None) -> None:
+        self.events.put((event, value, None))
+
+    def _set_ready(self, ready: bool = True) -> None:
+        """Report the startup latency to the current subscribers (later ones get it on subscribe)"""
+        with self.subscribers_lock:
+            self.ready_latency = perf_counter() - self.created if ready else None
+            self.ready.set()
+            self.events.put(("ready", self.ready_latency, list(self.subscribers)))
+
+    def _emit(self, event: str, value, subscribers=None) -> None:
+        for callback in self.subscribers if subscribers is None else subscribers:
+            try:
+                callback(event, value)
+            except Exception as ex:
+                print(f"Player subscriber failed: {ex}")
+
+    def _dispatch(self) -> None:
+        next_tick = None
+        while True:
+            timeout = None
+            if next_tick is not None:
+                timeout = max(0.0, next_tick - monotonic())
+            try:
+                event, value, subscribers = self.events.get(timeout=timeout)
+            except Empty:
+                try:
+                    self._emit("position", (self.get_position(), self.get_length()))
+                except Exception as ex:
+                    print(f"Player position failed: {ex}")
+                next_tick = monotonic() + 1 / self.position_rate
+                continue
+
+            if event == "state":
+                if value == self.status:
+                    continue
+                self.status = value
+                # Ticks run only while playing, otherwise the thread blocks on the queue
+                next_tick = monotonic() if value == "Playing" and self.position_rate else None
+            self._emit(event, value, subscribers)
+
+    def play(self) -> None:
+        raise NotImplementedError
+
+    def pause(self) -> None:
+        raise NotImplementedError
+
+    def set_media(self, url: str) -> None:
+        raise NotImplementedError
+
+    def seek(self, position: int) -> None:
+        raise NotImplementedError
+
+    def get_position(self) -> int:
+        raise NotImplementedError
+
+    def get_length(self) -> int:
+        raise NotImplementedError
+
+    def is_playing(self) -> bool:
+        return self.get_status() == "Playing"
+
+    def get_status(self) -> str:
+        raise NotImplementedError
+
+    def set_volume(self, volume: int) -> None:
+        """Volume in percent, 0..100"""
+        raise NotImplementedError
+
+    def queue_next(self, url: str) -> bool:
+        """
+        Queue the media that plays right after the current one, replacing
+        an earlier queued one. Returns False if the backend can't do that.
+        """
+        return False
+
+
+class VlcPlayer(EventPlayer):
+    """
+    In-process libvlc player. Media play through a MediaListPlayer, so a
+    queued next track starts as soon as the current one ends, without a
+    round trip through the app. State comes from the libvlc event manager.
+    Times are in ms.
+    """
+
+    #: libvlc states as MPRIS playback statuses
+    STATUS = {
+        vlc.State.Playing: "Playing",
+        vlc.State.Paused: "Paused",
+    }
+
+    def __init__(self, position_rate: float = POSITION_RATE):
+        super().__init__(position_rate)
+        self.instance = vlc.Instance()
+        self.player = self.instance.media_player_new()
+        self.list_player = self.instance.media_list_player_new()
+        self.list_player.set_media_player(self.player)
+        self.media_list = self.instance.media_list_new()
+        self.list_player.set_media_list(self.media_list)
+        self.lock = Lock()
+        #: Urls queued behind the current media, in list order
+        self.queued = []
+        #: The next item set by the list player is the one of set_media, not a queued one
+        self.started = False
+        #: set_media replaced the list, play() starts it from its first item
+        self.fresh = False
+
+        # libvlc must not be called from its own callbacks: only queue the events here
+        events = self.player.event_manager()
+        events.event_attach(vlc.EventType.MediaPlayerPlaying, lambda e: self._post("state", "Playing"))
+        events.event_attach(vlc.EventType.MediaPlayerPaused, lambda e: self._post("state", "Paused"))
+        events.event_attach(vlc.EventType.MediaPlayerStopped, lambda e: self._post("state", "Stopped"))
+        events.event_attach(vlc.EventType.MediaPlayerEndReached, self._on_end)
+        self.list_player.event_manager().event_attach(vlc.EventType.MediaListPlayerNextItemSet, self._on_next_item)
+        # In-process: ready as soon as libvlc is loaded
+        self._set_ready()
+
+    def _on_end(self, event) -> None:
+        with self.lock:
+            if self.queued:
+                # The list player moves on to the queued media by itself
+                return
+        self._post("state", "Stopped")
+        self._post("end")
+
+    def _on_next_item(self, event) -> None:
+        with self.lock:
+            if not self.started:
+                self.started = True
+                return
+            url = self.queued.pop(0) if self.queued else None
+        if url is not None:
+            self._post("next", url)
+
+    def play(self) -> None:
+        with self.lock:
+            fresh, self.fresh = self.fresh, False
+        if fresh:
+            self.list_player.play_item_at_index(0)
+        else:
+            # Resume after a pause
+            self.list_player.play()
+
+    def pause(self) -> None:
+        self.player.set_pause(1)
+
+    def set_media(self, url: str) -> None:
+        # A new list alone doesn't drop the loaded item, play() would resume it
+        self.list_player.stop()
+        with self.lock:
+            self.media_list = self.instance.media_list_new([url])
+            self.list_player.set_media_list(self.media_list)
+            self.queued = []
+            self.started = False
+            self.fresh = True
+
+    def queue_next(self, url: str) -> bool:
+        media = self.instance.media_new(url)
+        # Open and parse it now, so the handoff only has to start decoding
+        media.parse_with_options(vlc.MediaParseFlag.network, 0)
+        with self.lock:
+            self.media_list.lock()
+            try:
+                if self.queued:
+                    self.media_list.remove_index(self.media_list.count() - 1)
+                    self.queued.pop()
+                self.media_list.add_media(media)
+                self.queued.append(url)
+            finally:
+                self.media_list.unlock()
+        return True
+
+    def seek(self, position: int) -> None:
+        self.player.set_time(int(position))
+
+    def get_position(self) -> int:
+        return max(0, self.player.get_time())
+
+    def get_length(self) -> int:
+        return max(0, self.player.get_length())
+
+    def get_status(self) -> str:
+        return self.STATUS.get(self.player.get_state(), "Stopped")
+
+    def set_volume(self, volume: int) -> None:
+        self.player.audio_set_volume(int(volume))
+
+
+def create_player(backend: str = PLAYER_BACKEND, **kwargs) -> EventPlayer:
+    """Player of the given backend, kwargs go to its constructor"""
+    if backend == "vlc":
+        return VlcPlayer(**kwargs)
+    if backend == "mpris":
+        # Imported here: playerctl builds on this module and needs jeepney
+        from playerctl import PlayerCtl
+        return PlayerCtl(**kwargs)
+    raise ValueError(f"Unknown player backend: {backend}")
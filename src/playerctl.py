@@ -1,117 +1,198 @@
-from os import process_cpu_count
-from subprocess import call, Popen
+from subprocess import Popen
 import subprocess
-from time import sleep
-from types import NoneType
+from threading import Lock, Thread
+from time import perf_counter, sleep
+from jeepney import DBusAddress, DBusErrorResponse, HeaderFields, MatchRule, Properties, new_method_call
+from jeepney.bus_messages import message_bus
+from jeepney.io.blocking import open_dbus_connection
+from player import EventPlayer, POSITION_RATE
 
+#: Player started in the background, controlled over its MPRIS interface
+PLAYER_COMMAND = "vlc --intf dummy"
+
+#: Well-known bus name prefix of VLC's MPRIS interface
+MPRIS_NAME = "org.mpris.MediaPlayer2.vlc"
+MPRIS_PATH = "/org/mpris/MediaPlayer2"
+PLAYER_INTERFACE = "org.mpris.MediaPlayer2.Player"
+
+#: Seconds VLC may take to show up on the bus
+READY_TIMEOUT = 10.0
+
+#: First and largest pause between readiness probes, doubling in between
+PROBE_DELAY = 0.01
+PROBE_MAX_DELAY = 0.5
+
+
+class PlayerCtl(EventPlayer):
+    """
+    Control a background VLC through MPRIS over one persistent D-Bus connection.
+
+    Every getter is a single property read on the open connection instead of
+    a `playerctl` process, so polling the player is cheap. State changes come
+    from the PropertiesChanged signals of the player. Times are in ms.
+    """
 
-class PlayerCtl:
     inst = None
 
-    def __init__(self):
+    def __init__(self, command: str = PLAYER_COMMAND, bus: str = "SESSION", position_rate: float = POSITION_RATE,
+                 ready_timeout: float = READY_TIMEOUT):
+        super().__init__(position_rate)
+        self.ready_timeout = ready_timeout
+        self.connection = open_dbus_connection(bus=bus)
+        # The blocking connection is shared by the UI and the dispatch threads
+        self.lock = Lock()
+        self.player = None
+        #: Unique bus name of the player, signals of other MPRIS players are ignored
+        self.owner = None
+        # A second connection only waits for signals, so calls never read them by mistake
+        self.signals = open_dbus_connection(bus=bus)
+        rule = MatchRule(
+            type="signal",
+            interface="org.freedesktop.DBus.Properties",
+            member="PropertiesChanged",
+            path=MPRIS_PATH,
+        )
+        self.signals.send_and_get_reply(message_bus.AddMatch(rule))
+        Thread(target=self._listen, daemon=True).start()
         self.inst = Popen(
-            "vlc --intf dummy".split(),
+            command.split(),
             shell=False,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.STDOUT,
         )
-        while self.get_status() != "Stopped":
-            print('Wait vlc')
-            pass
+        # Don't hold up the app while VLC starts, commands wait for it instead
+        Thread(target=self._wait_ready, daemon=True).start()
 
     def __del__(self):
         print("destruct")
-        self.inst.terminate()
+        if self.inst is not None:
+            self.inst.terminate()
+
+    def close(self) -> None:
+        self.connection.close()
+        self.signals.close()
+
+    def _wait_ready(self) -> None:
+        """Probe the bus with exponential backoff until VLC answers or the timeout passes"""
+        deadline = perf_counter() + self.ready_timeout
+        delay = PROBE_DELAY
+        while perf_counter() < deadline:
+            if self.inst.poll() is not None:
+                print(f"Player exited with code {self.inst.returncode}")
+                break
+            if self._get("PlaybackStatus") is not None:
+                self._set_ready()
+                return
+            sleep(min(delay, max(0.0, deadline - perf_counter())))
+            delay = min(delay * 2, PROBE_MAX_DELAY)
+        self._set_ready(False)
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        """Block until startup is over, True if the player is up"""
+        self.ready.wait(self.ready_timeout if timeout is None else timeout)
+        return self.ready_latency is not None
+
+    def _listen(self) -> None:
+        """Turn PlaybackStatus changes into player events"""
+        playing = False
+        while True:
+            try:
+                message = self.signals.receive()
+            except Exception:
+                # Connection closed
+                return
+            if self.owner is None or message.header.fields.get(HeaderFields.sender) != self.owner:
+                continue
+            interface, changed, _ = message.body
+            if interface != PLAYER_INTERFACE or "PlaybackStatus" not in changed:
+                continue
+            status = changed["PlaybackStatus"][1]
+            self._post("state", status)
+            # VLC stops when its single item is over
+            if status == "Stopped" and playing:
+                self._post("end")
+            playing = status == "Playing"
+
+    def _call(self, message):
+        with self.lock:
+            return self.connection.send_and_get_reply(message)
+
+    def _resolve(self):
+        """Address of the player interface, None until the player is on the bus"""
+        if self.player is None:
+            names = self._call(message_bus.ListNames()).body[0]
+            # Newer VLC versions register "vlc.instance<pid>" besides or instead of "vlc"
+            own = f"{MPRIS_NAME}.instance{self.inst.pid}" if self.inst else None
+            players = sorted(name for name in names if name == MPRIS_NAME or name.startswith(MPRIS_NAME + "."))
+            if own in players:
+                players = [own]
+            if players:
+                self.owner = self._call(message_bus.GetNameOwner(players[0])).body[0]
+                self.player = DBusAddress(MPRIS_PATH, bus_name=players[0], interface=PLAYER_INTERFACE)
+        return self.player
+
+    def _get(self, name: str, default=None):
+        """Read a property of the player interface, default if the player is gone"""
+        player = self._resolve()
+        if player is None:
+            return default
+        try:
+            return self._call(Properties(player).get(name)).body[0][1]
+        except DBusErrorResponse:
+            # The player quit or restarted: look its name up again next time
+            self.player = None
+            return default
+
+    def _method(self, name: str, signature: str = None, body: tuple = ()) -> None:
+        # A command sent before VLC is on the bus would be lost
+        self.wait_ready()
+        player = self._resolve()
+        if player is None:
+            return
+        try:
+            self._call(new_method_call(player, name, signature, body))
+        except DBusErrorResponse:
+            self.player = None
 
     def play(self) -> None:
-        call(
-            ("playerctl play".split()),
-            shell=False,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.STDOUT,
-        )
+        self._method("Play")
 
     def pause(self) -> None:
-        call(
-            ("playerctl pause".split()),
-            shell=False,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.STDOUT,
-        )
+        self._method("Pause")
 
     def set_media(self, url: str) -> None:
-        call(
-            (f"playerctl open {url}".split()),
-            shell=False,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.STDOUT,
-        )
+        self._method("OpenUri", "s", (url,))
 
     def seek(self, seconds: int) -> None:
-        call(
-            (f"playerctl position {seconds//1000}".split()),
-            shell=False,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.STDOUT,
-        )
+        # Despite the name the position comes in ms, MPRIS wants µs
+        track_id = self._get("Metadata", {}).get("mpris:trackid")
+        if track_id is None:
+            return
+        self._method("SetPosition", "ox", (track_id[1], int(seconds) * 1000))
 
     def get_position(self) -> float:
         if self.get_length() == 0:
             return 0
-        process = Popen(
-            "playerctl position",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        out = process.stdout
-
-        if out != None:
-            data = float(out.read().decode().strip())
-            return int(data * 1000)   # pyright:ignore
-        else:
-            return 0
+        return self._get("Position", 0) // 1000
 
     def get_length(self) -> int:
-        process = Popen(
-            'playerctl metadata --format "{{ mpris:length }}"',
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        out = process.stdout
-        if out == None:
+        length = self._get("Metadata", {}).get("mpris:length")
+        if length is None:
             return 0
-        data = out.read().decode().strip()
-        if not data.isdigit():
-            return 0
-
-        return int(data) // 1000
-
-    def is_playing(self) -> bool:
-        procces = Popen(
-            "playerctl status",
-            shell=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-        )
-        out = procces.stdout.read()
-        return (
-            True
-            if out.decode().strip()  # pyright:ignore
-            == "Playing"
-            else False
-        )
+        return int(length[1]) // 1000
 
     def get_status(self) -> str:
-        procces = Popen(
-            "playerctl status",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        out = procces.stdout.read()
-        return out.decode().strip()
+        return self._get("PlaybackStatus", "")
+
+    def set_volume(self, volume: int) -> None:
+        self.wait_ready()
+        player = self._resolve()
+        if player is None:
+            return
+        try:
+            self._call(Properties(player).set("Volume", "d", volume / 100))
+        except DBusErrorResponse:
+            self.player = None
 
 
 # ctl = PlayerCtl()
@@ -1,12 +1,190 @@
+import asyncio
+import os
+import sys
 import requests
 import json
+from pathlib import Path
+from threading import Thread
+from time import time
 from bs4 import BeautifulSoup
+from urllib.parse import urlparse, parse_qs
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 BASE_URL = "https://api-v2.soundcloud.com"
 
+#: Connect/read timeouts (seconds) used for every request
+DEFAULT_TIMEOUT = (3.05, 15)
+
+#: On-disk cache of values fetched at startup (browser/app version)
+BOOTSTRAP_FILE = Path.home() / ".soundcloud" / "bootstrap.json"
+BOOTSTRAP_TTL = 24 * 60 * 60
+
+#: Used until the first successful bootstrap refresh
+DEFAULT_FIREFOX_VERSION = "133.0"
+
+
+def make_session(pool_size: int = 10, retries: int = 3, backoff_factor: float = 0.3) -> requests.Session:
+    """Create keep-alive session with connection pool and retry/backoff"""
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def next_offset(likes: dict):
+    """Offset cursor of the next likes page, None on the last page"""
+    next_href = likes.get("next_href")
+    if not next_href:
+        return None
+    offset = parse_qs(urlparse(next_href).query).get("offset")
+    return offset[0] if offset else None
+
+
+#: How select_transcoding ranks the formats of a track:
+#: "lowest_latency" - progressive first (one request, no playlist), then fewer bytes
+#: "smallest_bytes" - lowest bitrate first, for metered links
+#: "best_quality"   - highest bitrate first
+TRANSCODING_POLICY = "lowest_latency"
+
+#: Protocols the players can open (encrypted HLS variants can't be played)
+PLAYABLE_PROTOCOLS = ("progressive", "hls")
+
+#: Bitrate (kbps) of a codec when the preset name doesn't carry one
+CODEC_BITRATES = {"mp3": 128, "opus": 64, "aac": 160}
+
+
+def transcoding_codec(transcoding: dict):
+    """Codec of a transcoding from its mime type: mp3, aac, opus or None"""
+    mime_type = transcoding.get("format", {}).get("mime_type", "")
+    if "opus" in mime_type:
+        return "opus"
+    if "mp4" in mime_type or "aac" in mime_type:
+        return "aac"
+    if "mpeg" in mime_type:
+        return "mp3"
+    return None
+
+
+def transcoding_bitrate(transcoding: dict) -> int:
+    """Bitrate (kbps) of a transcoding, from preset like "aac_160k" or codec default"""
+    preset = transcoding.get("preset", "")
+    for part in preset.split("_"):
+        if part.endswith("k") and part[:-1].isdigit():
+            return int(part[:-1])
+    return CODEC_BITRATES.get(transcoding_codec(transcoding), 128)
+
+
+def select_transcoding(transcodings: list, policy: str = TRANSCODING_POLICY):
+    """
+    Pick the transcoding to cache and play according to policy.
+
+    Snipped previews and unplayable protocols are skipped when anything
+    else is available. Returns None for an empty list.
+    """
+    usable = [
+        t for t in transcodings
+        if t.get("url") and not t.get("snipped")
+        and t.get("format", {}).get("protocol") in PLAYABLE_PROTOCOLS
+    ] or transcodings
+    if not usable:
+        return None
+
+    def rank(transcoding):
+        not_progressive = transcoding.get("format", {}).get("protocol") != "progressive"
+        bitrate = transcoding_bitrate(transcoding)
+        if policy == "smallest_bytes":
+            return (bitrate, not_progressive)
+        if policy == "best_quality":
+            return (-bitrate, not_progressive)
+        return (not_progressive, bitrate)
+
+    return min(usable, key=rank)
+
+
+#: Fields of a Track, also the column order of the library table
+TRACK_FIELDS = ("track_id", "title", "author", "artwork_url", "url", "auth", "duration", "liked_at", "codec", "protocol")
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Track:
+    """
+    One liked track, shared by the library and all front ends.
+
+    Slots instead of a per-instance dict keep a large library small, and the
+    strings many tracks repeat (author, codec, protocol) are interned.
+    """
+
+    __slots__ = TRACK_FIELDS
+
+    def __init__(self, track_id: int, title: str, author: str, artwork_url: str = None, url: str = None,
+                 auth: str = None, duration: int = 0, liked_at: str = "", codec: str = None, protocol: str = None):
+        self.track_id = track_id
+        self.title = title
+        self.author = _intern(author)
+        self.artwork_url = artwork_url
+        #: Transcoding url, resolved to a stream url with auth
+        self.url = url
+        self.auth = auth
+        #: Length in ms
+        self.duration = duration
+        self.liked_at = liked_at
+        # Chosen format, so every cache fill of a track uses the same one
+        self.codec = _intern(codec)
+        self.protocol = _intern(protocol)
+
+    def astuple(self) -> tuple:
+        """Values in TRACK_FIELDS order"""
+        return tuple(getattr(self, field) for field in TRACK_FIELDS)
+
+    def __eq__(self, other):
+        return isinstance(other, Track) and self.astuple() == other.astuple()
+
+    def __repr__(self):
+        return f"Track({self.track_id}, {self.title!r}, {self.author!r})"
+
+
+def parse_track(track: dict, liked_at: str = "", policy: str = TRANSCODING_POLICY) -> Track:
+    """Turn an API track object into a Track"""
+    transcoding = select_transcoding(track.get("media", {}).get("transcodings") or [], policy) or {}
+    return Track(
+        track["id"],
+        track["title"],
+        track["user"]["username"],
+        artwork_url=track.get("artwork_url"),
+        url=transcoding.get("url"),
+        auth=track.get("track_authorization"),
+        duration=track.get("duration", 0),
+        liked_at=liked_at,
+        codec=transcoding_codec(transcoding),
+        protocol=transcoding.get("format", {}).get("protocol"),
+    )
+
+
+def parse_likes(likes: dict, policy: str = TRANSCODING_POLICY) -> list:
+    """Turn an API likes page into Tracks, playlists are skipped"""
+    return [
+        parse_track(item["track"], item.get("created_at", ""), policy)
+        for item in likes["collection"]
+        if "track" in item
+    ]
+
+
 class Soundcloud:
 
-    def __init__(self, o_auth, client_id):
+    def __init__(self, o_auth, client_id, pool_size: int = 10, timeout=DEFAULT_TIMEOUT, retries: int = 3, backoff_factor: float = 0.3,
+                 lazy: bool = True, bootstrap_file=BOOTSTRAP_FILE, bootstrap_ttl: float = BOOTSTRAP_TTL):
 
         #: Client id for soundcloud account(must be 32bytes length)
         if len(client_id) != 32:
@@ -16,31 +194,164 @@ class Soundcloud:
         #: O-Auth code for requests headers
         self.o_auth = o_auth
 
-        # To get the last version of Firefox to prevent some type of deprecated version
-        json_versions = dict(requests.get("https://product-details.mozilla.org/1.0/firefox_versions.json").json())
-        firefox_version = json_versions.get('LATEST_FIREFOX_VERSION')
+        #: Pooled keep-alive transport, every request goes through it
+        self.session = make_session(pool_size, retries, backoff_factor)
+        self.timeout = timeout
+
+        #: Bootstrap values (browser version, app version) are cached on disk
+        self.bootstrap_file = Path(bootstrap_file)
+        self.bootstrap_ttl = bootstrap_ttl
+        bootstrap = self._read_bootstrap()
+        firefox_version = bootstrap.get("firefox_version", DEFAULT_FIREFOX_VERSION)
 
         #: Default headers that work properly for the API
         #: User-Agent as if it was requested through Firefox Browser
         self.headers = {"Authorization" : o_auth, "Accept": "application/json",
-                        "User-Agent": f"Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:{firefox_version}) Gecko/20100101 Firefox/{firefox_version}"}
+                        "User-Agent": self._user_agent(firefox_version)}
 
-	
         # Version of soundcloud app
-        app_json = requests.get("https://soundcloud.com/versions.json")
-        self.app_version = dict(app_json.json()).get('app')
+        self.app_version = bootstrap.get("app_version")
+
+        # Refresh stale values: in background when lazy, right now otherwise
+        if time() - bootstrap.get("fetched_at", 0) > self.bootstrap_ttl:
+            if lazy:
+                Thread(target=self.refresh_bootstrap, daemon=True).start()
+            else:
+                self.refresh_bootstrap()
+
+    @staticmethod
+    def _user_agent(firefox_version: str) -> str:
+        return f"Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:{firefox_version}) Gecko/20100101 Firefox/{firefox_version}"
+
+    def _read_bootstrap(self) -> dict:
+        """Read cached bootstrap values, empty dict if missing or broken"""
+        try:
+            with open(self.bootstrap_file, "r") as f:
+                return dict(json.load(f))
+        except (OSError, ValueError):
+            return {}
+
+    def refresh_bootstrap(self) -> bool:
+        """Fetch fresh browser/app versions and store them on disk"""
+        try:
+            # To get the last version of Firefox to prevent some type of deprecated version
+            json_versions = dict(self._get("https://product-details.mozilla.org/1.0/firefox_versions.json").json())
+            firefox_version = json_versions.get('LATEST_FIREFOX_VERSION') or DEFAULT_FIREFOX_VERSION
+            app_version = dict(self._get("https://soundcloud.com/versions.json").json()).get('app')
+        except (requests.RequestException, ValueError):
+            # Offline or host unreachable: keep cached/default values
+            return False
+
+        self.headers["User-Agent"] = self._user_agent(firefox_version)
+        self.app_version = app_version
+
+        bootstrap = {"firefox_version": firefox_version, "app_version": app_version, "fetched_at": time()}
+        try:
+            self.bootstrap_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.bootstrap_file.with_suffix(".tmp")
+            with open(tmp_file, "w") as f:
+                json.dump(bootstrap, f)
+            os.replace(tmp_file, self.bootstrap_file)
+        except OSError:
+            pass
+        return True
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        """GET through the pooled session with default timeout"""
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def close(self) -> None:
+        """Close pooled connections"""
+        self.session.close()
 
     # ---------------- USER ----------------
 
     def get_likes(self,offset:str='0',user_id=799535824, limit:int=24):
-        
-        req = requests.get(f"{BASE_URL}/users/{user_id}/likes?offset={offset}&limit={limit}&client_id={self.client_id}&app_version=1734100093&app_locale=en", headers=self.headers)
+
+        req = self._get(f"{BASE_URL}/users/{user_id}/likes?offset={offset}&limit={limit}&client_id={self.client_id}&app_version=1734100093&app_locale=en", headers=self.headers)
         return req.json()
 
     def get_stream(self,stream_url,track_authorization):
         stream_url = stream_url.replace("https","http")
-        
-        req = requests.get(f'{stream_url}?client_id={self.client_id}&track_authorization={track_authorization}')
+
+        req = self._get(f'{stream_url}?client_id={self.client_id}&track_authorization={track_authorization}')
+        return req.json()
+
+    def get_track(self, track_id):
+        """Current metadata of a track, with fresh transcodings and track_authorization"""
+        req = self._get(f"{BASE_URL}/tracks/{track_id}?client_id={self.client_id}", headers=self.headers)
+        req.raise_for_status()
         return req.json()
 
-    
\ No newline at end of file
+
+class AsyncSoundcloud:
+    """
+    Awaitable counterpart of Soundcloud with the same API surface.
+
+    Requests run on worker threads over the pooled session of the wrapped
+    sync client, so the event loop of the UI never waits on the network.
+    """
+
+    def __init__(self, o_auth, client_id, concurrency: int = 8, **kwargs):
+        self.client = Soundcloud(o_auth, client_id, pool_size=max(concurrency, kwargs.pop("pool_size", 10)), **kwargs)
+        self.concurrency = concurrency
+        self._semaphore = None
+
+    @classmethod
+    def wrap(cls, client: Soundcloud, concurrency: int = 8) -> "AsyncSoundcloud":
+        """Async view over an existing sync client, sharing its session"""
+        self = cls.__new__(cls)
+        self.client = client
+        self.concurrency = concurrency
+        self._semaphore = None
+        return self
+
+    def __getattr__(self, name):
+        # headers, client_id, app_version... are shared with the sync client
+        if name == "client":
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def _run(self, func, *args, **kwargs):
+        async with self.semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self.client.close)
+
+    # ---------------- USER ----------------
+
+    async def get_likes(self, offset: str = '0', user_id=799535824, limit: int = 24):
+        return await self._run(self.client.get_likes, offset=offset, user_id=user_id, limit=limit)
+
+    async def get_stream(self, stream_url, track_authorization):
+        return await self._run(self.client.get_stream, stream_url, track_authorization)
+
+    async def get_track(self, track_id):
+        return await self._run(self.client.get_track, track_id)
+
+    # ---------------- BULK ----------------
+
+    async def get_streams(self, tracks) -> list:
+        """Resolve many (stream_url, track_authorization) pairs concurrently, None on failure"""
+        async def resolve(url, auth):
+            try:
+                return await self.get_stream(url, auth)
+            except Exception:
+                return None
+
+        return await asyncio.gather(*(resolve(url, auth) for url, auth in tracks))
+
+    async def get_likes_pages(self, offsets, user_id=799535824, limit: int = 24) -> list:
+        """Fetch several likes pages for known offsets concurrently"""
+        return await asyncio.gather(
+            *(self.get_likes(offset=offset, user_id=user_id, limit=limit) for offset in offsets)
+        )
@@ -1,118 +1,217 @@
 from textual.app import App
 from textual.containers import ScrollableContainer, Vertical, Horizontal
-from textual.widgets import Button, Label
-from time import sleep
-import vlc
-from playerctl import PlayerCtl
-from textual import work
-import ffmpeg
-from pathlib import Path
-from soundcloud import Soundcloud
+from textual.widgets import Button, Label, Static
+import asyncio
+from player import create_player
+from soundcloud import AsyncSoundcloud, Track, next_offset, parse_likes
+from downloader import DownloadService, FirstAudioMeter, PLAY_NOW, PROGRESSIVE, resolve_track
+from cache import AudioCache
+from library import LibrarySync, LibraryStore, END_OFFSET, track_index
+from virtual_list import ListWindow
 import traceback
-import eyed3
+
+#: Lines taken by one track button
+TRACK_HEIGHT = 3
 
 class ScrollEndApp(App):
     CSS_PATH = "style.tcss"
+    BINDINGS = [("s", "sync_library", "Sync library"), ("c", "cache_stats", "Cache stats")]
 
     def __init__(self):
-        # Create cache directory if it doesn't exist
-        self.cache_dir = Path.home() / ".soundcloud"
-        self.cache_dir.mkdir(exist_ok=True)
         self.loaded = True
         # Initialize client and variables
-        self.client = Soundcloud("", "AsIBxSC4kw4QXdGp0vufY0YztIlkRMUc")
-        self.audio_player = PlayerCtl()
+        self.client = AsyncSoundcloud("", "AsIBxSC4kw4QXdGp0vufY0YztIlkRMUc")
+        self.library = LibraryStore()
+        self.cache = AudioCache()
+        # Drop truncated or corrupt files left by a crash, they are downloaded again
+        print(f"Cache validation: {self.cache.validate(self.library.durations())}")
+        self.downloads = DownloadService(self.client.client, self.cache, store=self.library)
+        self.downloads.subscribe(self.on_download_event)
+        self.progressive = PROGRESSIVE
+        self.first_audio = FirstAudioMeter()
+        self.audio_player = create_player()
+        # Index of the track handed to the player for a gapless start
+        self.queued = None
         self.liked_tracks = []
         self.offset: str = "0"
         self.index = -1
+        # Only the buttons around the viewport are mounted, recycled while scrolling
+        self.list_window = ListWindow(TRACK_HEIGHT)
+        self.rows = range(0)
+        self.row_pool = []
         super().__init__()
 
-    def download_track(self, url:str , output_file: str, title: str, artist: str):
+    def download_track(self, track: Track, stream_url: str) -> str:
         """
-        Download a track from the given stream URL.
+        Download a track ahead of any prefetch and wait for the cached file.
 
         Args:
-            url (str): The streaming URL of the audio track.
-            output_file (str): The file path where the downloaded MP3 will be saved.
+            track (Track): The track to download.
+            stream_url (str): The streaming URL of the audio track.
         """
         # Pause the audio player to avoid conflicts during download.
         self.audio_player.pause()
 
-        # Set the download flag to True and reset the progress bar value.
-
-        # Use ffmpeg to download and convert the stream to an MP3 file.
-        ffmpeg.input(url).output(output_file, format="mp3", loglevel="quiet").run()
-        tags = eyed3.load(output_file)
-        tags.tag.title = title #pyright:ignore
-        tags.tag.artist = artist #pyright:ignore
-        tags.tag.save() #pyright:ignore
-        # Reset the progress bar and download flag after the process completes.
+        path = self.downloads.submit(track, PLAY_NOW, stream_url=stream_url).wait()
+        if path is None:
+            raise RuntimeError(f"Download of {track.title} failed")
+        return str(path)
 
-    def load_likes(self, offset:str="0"):
+    async def load_likes(self, offset:str="0"):
         """Fetch liked tracks."""
         print("Fetching liked tracks...")
         try:
-            likes = self.client.get_likes(limit=24, offset=offset)
+            likes = await self.client.get_likes(limit=24, offset=offset)
             if not likes["collection"]:
-                self.offset = "-1"
+                self.offset = END_OFFSET
+                self.library.set_meta("next_offset", END_OFFSET)
                 return []  # No more tracks
 
-            self.offset = likes.get("next_href", None)
-            self.offset = self.offset[
-                self.offset.index("?") + 8 : self.offset.index("&")
-            ]
-            delta = []
-            for item in likes["collection"]:
-                if "playlist" in item:
-                    continue  # Skip playlists
-                track = item["track"]
-                self.liked_tracks.append(
-                    {
-                        "title": track["title"],
-                        "url": track["media"]["transcodings"][0]["url"],
-                        "auth": track.get("track_authorization"),
-                        "artwork_url": track.get(
-                            "artwork_url", "https://via.placeholder.com/500"
-                        ),
-                        "track_id": track["id"],
-                        "author": track["user"]["username"],
-                    }
-                )
-                delta.append(self.liked_tracks[-1])
+            offset = next_offset(likes)
+            self.offset = END_OFFSET if offset is None else offset
+            delta = self.add_likes(likes)
+            self.library.set_meta("next_offset", self.offset)
             return delta
         except Exception:
             self.notify("Fetch err " + str(traceback.format_exc()))
             return []
 
-    def play_track(self, index:int):
-        """Play the track at the given index."""
+    def add_likes(self, likes: dict) -> list:
+        """Store a page of liked tracks, return the new ones"""
+        delta = parse_likes(likes)
+        self.library.add(delta)
+        self.liked_tracks.extend(delta)
+        return delta
+
+    def render_tracks(self, force: bool = False):
+        """Bind the pooled buttons to the tracks around the viewport"""
+        scrollable = self.query_one("#scrollable")
+        total = len(self.liked_tracks)
+        rows = self.list_window.visible(scrollable.scroll_y, scrollable.size.height or 50, total)
+        if rows == self.rows and not force:
+            return
+        self.rows = rows
+
+        # The pool grows to the largest window seen and is recycled from then on
+        new = [
+            Button("", classes="track", id=f"row_{i}")
+            for i in range(len(self.row_pool), len(rows))
+        ]
+        if new:
+            scrollable.mount_all(new, before="#bottom_spacer")
+            self.row_pool.extend(new)
+        for button, index in zip(self.row_pool, rows):
+            track = self.liked_tracks[index]
+            button.label = track.title + "||" + track.author
+            button.track_index = index
+            button.display = True
+        for button in self.row_pool[len(rows):]:
+            button.display = False
+
+        top, bottom = self.list_window.spacers(rows, total)
+        self.query_one("#top_spacer").styles.height = top
+        self.query_one("#bottom_spacer").styles.height = bottom
+
+    def load_library(self):
+        """Show the stored library, the network part runs in a worker."""
+        tracks = self.library.tracks()
+        if tracks:
+            self.liked_tracks.extend(tracks)
+            self.offset = self.library.get_meta("next_offset", "0")
+            self.render_tracks(force=True)
+        # Awaiting the network here would hold up every input until it answers
+        self.run_worker(self.refresh_library(bool(tracks)), group="library")
+
+    async def refresh_library(self, stored: bool):
+        """Apply changes from the first likes page, or load it if nothing is stored."""
+        if not stored:
+            self.loaded = False
+            try:
+                await self.load_likes(self.offset)
+                self.render_tracks(force=True)
+            finally:
+                self.loaded = True
+            return
+
+        try:
+            # Fetch only what's new since the last launch
+            stats = await LibrarySync(self.client, page_size=24).delta(self.library)
+            self.notify(f"Library delta sync: {stats}")
+            if stats.changed:
+                # Liked or unliked since the last launch: rebuild the list
+                self.reload_tracks()
+        except Exception:
+            self.notify("Library refresh err " + str(traceback.format_exc()))
+
+    def reload_tracks(self):
+        """Rebuild the track list from the library, following the playing and the queued track."""
+        playing = self.liked_tracks[self.index].track_id if self.index >= 0 else None
+        queued = None if self.queued is None else self.liked_tracks[self.queued].track_id
+        self.liked_tracks = self.library.tracks()
+        self.index = track_index(self.liked_tracks, playing, -1)
+        # The queued track is only right if it still follows the playing one
+        if queued is None or track_index(self.liked_tracks, queued) != self.index + 1:
+            self.queued = None
+            if self.index >= 0:
+                self.queue_gapless()
+        else:
+            self.queued = self.index + 1
+        self.render_tracks(force=True)
+
+    async def play_track(self, index:int, queued=False):
+        """Play the track at the given index, only follow it in the UI if the player already started it."""
         track = self.liked_tracks[index]
-        title = track["title"]
-        url = track["url"]
-        auth = track["auth"]
-        track_id = track["track_id"]
-
-        cache_file = self.cache_dir / f"{track_id}.mp3"
-        if not cache_file.exists():
-            print(f"Downloading {title}...")
-            while True:
-                try:
-                    stream_url = self.client.get_stream(url, auth)["url"]
-                except KeyError:
-                    print("Wait 0.1s")
-                    sleep(0.1)  # Retry after a short delay.
+        title = track.title
+        track_id = track.track_id
+
+        if not queued:
+            self.first_audio.start(track_id)
+            cache_file = self.cache.lookup(track_id)
+            self.cache.played(track_id)
+            media = str(cache_file)
+            if cache_file is None:
+                print(f"Downloading {title}...")
+                # A stale stored authorization is refreshed from the API
+                stream_url = await asyncio.to_thread(resolve_track, self.client.client, track, self.library)
+                if self.progressive:
+                    # Play straight from the stream, the cache file is written in parallel
+                    # (a prefetch of this track already in flight is reused)
+                    self.downloads.submit(track, PLAY_NOW, stream_url=stream_url)
+                    media = stream_url
                 else:
-                    break
-            self.download_track(stream_url, str(cache_file), title, track["author"])
+                    media = await asyncio.to_thread(self.download_track, track, stream_url)
 
-        self.audio_player.set_media(str(cache_file))
-        self.audio_player.play()
+            self.audio_player.set_media(media)
+            self.audio_player.play()
+            self.queued = None
+        else:
+            self.cache.played(track_id)
         self.index = index
         name: Label = self.query_one("#track_name")
         author: Label = self.query_one("#track_author")
         name.update(title)
-        author.update(track["author"])
-        print(f"Now playing: {title} by {track['author']}")
+        author.update(track.author)
+        print(f"Now playing: {title} by {track.author}")
+
+        # Pre-download the next tracks so skipping to them is instant
+        upcoming = self.liked_tracks[index + 1 : index + 1 + self.downloads.depth]
+        self.cache.pin([track_id] + [track.track_id for track in upcoming])
+        self.downloads.prefetch(upcoming)
+        self.queue_gapless()
+
+    def queue_gapless(self):
+        """Hand the next track to the player once it is cached, so it starts without a gap."""
+        index = self.index + 1
+        if index >= len(self.liked_tracks) or self.queued == index:
+            return
+        path = self.cache.get(self.liked_tracks[index].track_id)
+        if path is not None and self.audio_player.queue_next(str(path)):
+            self.queued = index
+
+    def on_download_event(self, job, event):
+        if event == "done" and self.queued is None:
+            # The prefetch of the next track may have just finished
+            self.queue_gapless()
 
     def format_ms(self, time):
         curr_seconds = time // 1000
@@ -121,27 +220,35 @@ class ScrollEndApp(App):
             f"{str(int(curr_minutes)).zfill(2)}:{str(curr_seconds%60).zfill(2)}"
         )
 
-    @work(thread=True)
-    def time_update(self):
-        while True:
-            sleep(0.1)
-            
-            play_time: Label = self.query_one("#play_time")
-            position = self.audio_player.get_position()
-            duration = self.audio_player.get_length()
-            if position == -1:
-                play_time.update(f"00:00/00:00")
-            else:
-                play_time.update(
-                    f"{self.format_ms(int(position))}/{self.format_ms(duration)}"
-                )
-            if self.audio_player.get_status() == 'Stopped':
-                self.next_track()
-
-    def next_track(self):
+    def time_update(self, position: int, duration: int):
+        play_time: Label = self.query_one("#play_time")
+        if position == -1:
+            play_time.update(f"00:00/00:00")
+        else:
+            play_time.update(
+                f"{self.format_ms(int(position))}/{self.format_ms(duration)}"
+            )
+
+    def on_player_event(self, event: str, value):
+        """Follow the player state, called from the player's dispatch thread."""
+        if event == "position":
+            self.call_from_thread(self.time_update, *value)
+        elif event == "ready":
+            self.call_from_thread(self.notify, "Player not ready" if value is None else f"Player ready in {value:.2f}s")
+        elif event == "state":
+            if value == "Playing" and self.first_audio.requested is not None:
+                print(f"Time to first audio: {self.first_audio.playing():.2f}s")
+        elif event == "next" and self.queued is not None:
+            # The player moved on to the queued track by itself
+            index, self.queued = self.queued, None
+            self.call_from_thread(self.play_track, index, True)
+        elif event == "end" and not self.first_audio.waiting():
+            self.call_from_thread(self.next_track)
+
+    async def next_track(self):
         """Play the next track."""
         if self.index < len(self.liked_tracks) - 1:
-            self.play_track(self.index + 1)
+            await self.play_track(self.index + 1)
         else:
             print("No more tracks in the list.")
 
@@ -153,20 +260,20 @@ class ScrollEndApp(App):
             self.query_one("#pause").label = "⏸"
             self.audio_player.play()
 
-    def prev_track(self):
+    async def prev_track(self):
         """Play the previous track."""
         if self.index > 0:
-            self.play_track(self.index - 1)
+            await self.play_track(self.index - 1)
         else:
             print("Already at the first track.")
 
-    def show_tracks(self):
+    async def show_tracks(self):
         """Display the liked tracks."""
         if not self.liked_tracks:
             print("No liked tracks loaded. Fetching more...")
-            self.load_likes()
+            await self.load_likes()
         for i, track in enumerate(self.liked_tracks):
-            print(f"{i + 1}. {track['title']} by {track['author']}")
+            print(f"{i + 1}. {track.title} by {track.author}")
 
     def compose(self):
         yield Vertical(
@@ -181,54 +288,72 @@ class ScrollEndApp(App):
             ),
             id="sidebar",
         )
-        yield ScrollableContainer(id="scrollable")
+        yield ScrollableContainer(
+            Static(id="top_spacer"),
+            Static(id="bottom_spacer"),
+            id="scrollable",
+        )
 
-    def on_mount(self):
+    async def on_mount(self):
         scrollable = self.query_one("#scrollable")
 
-        for i, track in enumerate(self.load_likes(self.offset)):
-            scrollable.mount(
-                Button(
-                    track["title"] + "||" + track["author"],
-                    classes="track",
-                    id="track_" + str(i),
-                )
-            )
-        self.time_update()
+        # The player starts in parallel and reports when it's ready
+        self.audio_player.subscribe(self.on_player_event)
+        self.load_library()
         self.watch(scrollable, "scroll_y", self.watch_scroll_y)
 
-    def on_button_pressed(self, event: Button.Pressed) -> None:
-        if event.button.id.startswith("track"):
-            self.play_track(int(event.button.id[6:]))
+    async def on_button_pressed(self, event: Button.Pressed) -> None:
+        if event.button.id.startswith("row"):
+            await self.play_track(event.button.track_index)
         elif event.button.id == "pause":
             self.pause_track()
         elif event.button.id == "next":
-            self.next_track()
+            await self.next_track()
         elif event.button.id == "prev":
-            self.prev_track()
+            await self.prev_track()
 
-    def watch_scroll_y(self, value):
+    async def watch_scroll_y(self, value):
         scrollable = self.query_one("#scrollable")
-        if self.offset == "-1":
+        self.render_tracks()
+        if self.offset == END_OFFSET:
             return
         if (
             abs(scrollable.max_scroll_y - scrollable.scroll_y) <= 0
             and scrollable.scroll_y > 1
         ):
-            count_liked = len(self.liked_tracks)
-            liked = self.load_likes(self.offset)
             if not self.loaded:
                 return
             self.loaded = False
-            for i, track in enumerate(liked):
-                butt = Button(
-                    track["title"] + "||" + track["author"],
-                    classes="track",
-                    id="track_" + str(i + count_liked),
-                )
-                scrollable.mount(butt)
-                if i == 0:
-                    butt.scroll_visible()
+            await self.load_likes(self.offset)
+            self.render_tracks(force=True)
+            self.loaded = True
+
+    def action_cache_stats(self):
+        """Show audio cache stats."""
+        self.notify(f"Cache: {self.cache.report()}")
+
+    async def action_sync_library(self):
+        """Load the rest of the liked tracks in background."""
+        if self.offset == END_OFFSET or not self.loaded:
+            return
+        self.loaded = False
+
+        def on_page(likes):
+            self.add_likes(likes)
+            # Move the cursor with every stored page, so an interrupted sync resumes here
+            offset = next_offset(likes)
+            self.offset = END_OFFSET if offset is None else offset
+            self.library.set_meta("next_offset", self.offset)
+            self.render_tracks(force=True)
+
+        try:
+            stats = await LibrarySync(self.client).run(on_page, offset=self.offset)
+            self.offset = END_OFFSET
+            self.library.set_meta("next_offset", END_OFFSET)
+            self.notify(f"Library synced: {stats}")
+        except Exception:
+            self.notify("Sync err " + str(traceback.format_exc()))
+        finally:
             self.loaded = True
 
 
@@ -0,0 +1,87 @@
+from threading import Condition, Thread
+from time import monotonic
+
+#: Least seconds between two flushes, one frame at 30 fps
+FRAME_BUDGET = 1 / 30
+
+
+class UpdateScheduler:
+    """
+    Coalesce flet page updates.
+
+    Callers mark controls dirty (or the whole page) instead of calling
+    page.update(); one thread sends everything marked in between as a single
+    update, at most once per frame budget. Assignments through set() that
+    don't change what a control shows are dropped before they cost a diff.
+    """
+
+    def __init__(self, page, frame_budget: float = FRAME_BUDGET):
+        self.page = page
+        self.frame_budget = frame_budget
+        self.cond = Condition()
+        #: id -> control waiting for the next flush, in marking order
+        self.dirty = {}
+        self.full = False
+        self.last_flush = 0.0
+        #: Updates sent to the client
+        self.sent = 0
+        #: Requests merged into a pending update or dropped as unchanged
+        self.suppressed = 0
+        Thread(target=self._run, daemon=True).start()
+
+    def update(self, *controls) -> None:
+        """Mark controls dirty, the whole page without arguments"""
+        with self.cond:
+            if self.full or self.dirty:
+                self.suppressed += 1
+            if controls:
+                for control in controls:
+                    self.dirty[id(control)] = control
+            else:
+                self.full = True
+            self.cond.notify()
+
+    def set(self, control, **values) -> bool:
+        """Assign attributes of a control, mark it dirty only if one of them changed"""
+        changed = False
+        for name, value in values.items():
+            if getattr(control, name) != value:
+                setattr(control, name, value)
+                changed = True
+        if changed:
+            self.update(control)
+        else:
+            with self.cond:
+                self.suppressed += 1
+        return changed
+
+    def _run(self) -> None:
+        while True:
+            with self.cond:
+                while not (self.full or self.dirty):
+                    self.cond.wait()
+                # Let the frame fill up with whatever else gets marked
+                deadline = self.last_flush + self.frame_budget
+                while (remaining := deadline - monotonic()) > 0:
+                    self.cond.wait(remaining)
+                full, controls = self.full, list(self.dirty.values())
+                self.full = False
+                self.dirty.clear()
+                self.last_flush = monotonic()
+                self.sent += 1
+            try:
+                # A page update covers every dirty control
+                self.page.update(*([] if full else controls))
+            except Exception as ex:
+                print(f"Page update failed: {ex}")
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {"sent": self.sent, "suppressed": self.suppressed}
+
+    def report(self) -> str:
+        """Human readable update counters"""
+        stats = self.stats()
+        total = stats["sent"] + stats["suppressed"]
+        share = stats["suppressed"] / total if total else 0.0
+        return f"{stats['sent']} sent, {stats['suppressed']} suppressed ({share:.0%})"
@@ -0,0 +1,27 @@
+#: Rows kept beyond each edge of the viewport, so short scrolls show no gap
+OVERSCAN = 5
+
+
+class ListWindow:
+    """
+    Rows of a fixed-extent list that have to exist for a scroll position.
+
+    Front ends keep a small pool of row controls bound to this range and
+    replace everything above and below it with spacers of the same height,
+    so the scrollbar still covers the whole list while the control tree
+    stays the size of the viewport.
+    """
+
+    def __init__(self, extent: float, overscan: int = OVERSCAN):
+        #: Height of one row including its spacing, in the unit of the offsets
+        self.extent = extent
+        self.overscan = overscan
+
+    def visible(self, offset: float, viewport: float, total: int) -> range:
+        first = max(0, int(offset // self.extent) - self.overscan)
+        last = min(total, int((offset + viewport) // self.extent) + 1 + self.overscan)
+        return range(min(first, last), last)
+
+    def spacers(self, rows: range, total: int):
+        """Heights of the spacers above and below the materialized rows"""
+        return rows.start * self.extent, (total - rows.stop) * self.extent
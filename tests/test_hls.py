@@ -0,0 +1,141 @@
+"""HLS segment downloads against a local HTTP server."""
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from cache import AudioCache, SEGMENTS_TTL
+from hls import HLSDownloader, Throttle
+
+SEGMENTS = 10
+
+
+class Origin:
+    """Playlists and segments served from memory, with per-path delays"""
+
+    def __init__(self):
+        self.files = {}
+        self.delays = {}
+        self.requests = []
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                origin.requests.append(path)
+                time.sleep(origin.delays.get(path, 0))
+                body = origin.files.get(path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def playlist(self, name: str, count: int = SEGMENTS) -> str:
+        """Serve a playlist of count segments, return its url"""
+        lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:10"]
+        for i in range(count):
+            self.files[f"/{name}/{i}.ts"] = f"{name}:{i};".encode() * 100
+            lines += ["#EXTINF:10.0,", f"{name}/{i}.ts?Signature={time.time()}"]
+        self.files[f"/{name}.m3u8"] = "\n".join(lines + ["#EXT-X-ENDLIST"]).encode()
+        return f"{self.url}/{name}.m3u8?Policy=signed"
+
+    def content(self, name: str, count: int = SEGMENTS) -> bytes:
+        return b"".join(self.files[f"/{name}/{i}.ts"] for i in range(count))
+
+    def segment_requests(self, name: str) -> int:
+        return sum(1 for path in self.requests if path.startswith(f"/{name}/"))
+
+
+@pytest.fixture
+def origin():
+    origin = Origin()
+    yield origin
+    origin.server.shutdown()
+
+
+def test_segments_are_joined_in_playlist_order(origin, tmp_path):
+    url = origin.playlist("mp3")
+    # Early segments arrive last
+    for i in range(SEGMENTS):
+        origin.delays[f"/mp3/{i}.ts"] = (SEGMENTS - i) * 0.01
+    output = tmp_path / "track.hls"
+    stats = HLSDownloader(requests.Session(), segments_dir=tmp_path / "segments").download(url, 1, output)
+
+    assert output.read_bytes() == origin.content("mp3")
+    assert stats.segments == SEGMENTS and stats.resumed == 0
+    # Joined segments aren't kept
+    assert not any((tmp_path / "segments").iterdir())
+
+
+def test_cancelled_download_resumes_missing_segments(origin, tmp_path):
+    url = origin.playlist("mp3")
+    downloader = HLSDownloader(requests.Session(), workers=1, segments_dir=tmp_path / "segments")
+    done = []
+    with pytest.raises(InterruptedError):
+        downloader.download(url, 1, tmp_path / "track.hls", progress=done.append, cancelled=lambda: len(done) >= 3)
+    fetched = origin.segment_requests("mp3")
+    assert 3 <= fetched < SEGMENTS
+
+    stats = downloader.download(url, 1, tmp_path / "track.hls")
+    assert stats.resumed >= 3
+    assert origin.segment_requests("mp3") == SEGMENTS + (fetched - stats.resumed)
+    assert (tmp_path / "track.hls").read_bytes() == origin.content("mp3")
+
+
+def test_other_transcoding_does_not_reuse_segments(origin, tmp_path):
+    downloader = HLSDownloader(requests.Session(), workers=1, segments_dir=tmp_path / "segments")
+    done = []
+    with pytest.raises(InterruptedError):
+        downloader.download(origin.playlist("mp3"), 1, tmp_path / "track.hls",
+                            progress=done.append, cancelled=lambda: len(done) >= 3)
+
+    # Same track and segment count, another codec
+    stats = downloader.download(origin.playlist("aac"), 1, tmp_path / "track.hls")
+    assert stats.resumed == 0
+    assert (tmp_path / "track.hls").read_bytes() == origin.content("aac")
+
+
+def test_cache_drops_kept_segments(tmp_path):
+    cache = AudioCache(tmp_path, budget=1000)
+    stale = cache.segments_dir / "1-aaaa"
+    old = cache.segments_dir / "2-bbbb"
+    for directory in (stale, old):
+        directory.mkdir(parents=True)
+        (directory / "00000.seg").write_bytes(b"x" * 800)
+    os.utime(stale, (time.time() - SEGMENTS_TTL - 1,) * 2)
+    os.utime(old, (time.time() - 3600,) * 2)
+
+    # Startup removes segments past their ttl
+    assert cache.validate()["partials"] == 1
+    assert not stale.exists() and old.exists()
+
+    # Kept segments count against the budget and go before tracks
+    track = tmp_path / "3.mp3"
+    track.write_bytes(b"y" * 500)
+    cache.add(track, duration=1.0)
+    assert not old.exists()
+    assert cache.get(3) == track
+
+
+def test_throttle_caps_parallel_segment_transfers(origin, tmp_path):
+    url = origin.playlist("mp3")
+    size = len(origin.content("mp3"))
+    throttle = Throttle(rate=size / 0.5, burst=size / 10)
+    started = time.perf_counter()
+    HLSDownloader(requests.Session(), segments_dir=tmp_path / "segments").download(
+        url, 1, tmp_path / "track.hls", throttle=throttle)
+    # All segments together at the rate, minus the initial burst
+    assert time.perf_counter() - started >= 0.4
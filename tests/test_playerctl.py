@@ -0,0 +1,96 @@
+"""PlayerCtl against the stub MPRIS player of the benchmark, on a private session bus."""
+import shutil
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("jeepney")
+
+from playerctl import PlayerCtl  # noqa: E402
+
+STUB = Path(__file__).resolve().parent.parent / "benchmarks" / "playerctl_cpu.py"
+
+#: Track of the stub player, in ms
+LENGTH = 5_000
+
+
+@pytest.fixture
+def bus(monkeypatch):
+    if shutil.which("dbus-daemon") is None:
+        pytest.skip("dbus-daemon is not installed")
+    daemon = subprocess.Popen(
+        ["dbus-daemon", "--session", "--nofork", "--print-address"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    monkeypatch.setenv("DBUS_SESSION_BUS_ADDRESS", daemon.stdout.readline().strip())
+    yield
+    daemon.terminate()
+    daemon.wait()
+
+
+@pytest.fixture
+def player(bus):
+    player = PlayerCtl(command=f"{sys.executable} {STUB} --stub {LENGTH * 1000}", ready_timeout=5)
+    assert player.wait_ready()
+    yield player
+    player.inst.terminate()
+    player.inst.wait()
+    player.close()
+
+
+def test_getters_in_ms(player):
+    assert player.get_status() == "Stopped"
+    assert player.get_length() == LENGTH
+    assert player.get_position() == 0
+
+    player.set_media("file:///dev/null")
+    player.play()
+    assert player.get_status() == "Playing"
+    assert player.get_length() == LENGTH
+    assert 0 <= player.get_position() < LENGTH
+
+
+def test_seek_sends_microseconds(player):
+    player.play()
+    player.seek(3_000)
+    # A position taken as µs would land right at the start
+    assert 3_000 <= player.get_position() < 3_500
+
+    player.pause()
+    player.seek(LENGTH + 1_000)
+    # Past the end the player keeps its position
+    assert 3_000 <= player.get_position() < 3_500
+
+
+def test_end_after_playing(player):
+    events = []
+    ended = threading.Event()
+
+    def on_event(event, value):
+        if event in ("state", "end"):
+            events.append((event, value))
+        if event == "end":
+            ended.set()
+
+    player.subscribe(on_event)
+    player.play()
+    player.seek(LENGTH - 300)
+    assert ended.wait(5)
+    assert events == [("state", "Playing"), ("state", "Stopped"), ("end", None)]
+    assert player.get_status() == "Stopped"
+
+
+def test_no_end_without_playing(player):
+    events = []
+    player.subscribe(lambda event, value: events.append(event))
+    player.play()
+    player.pause()
+    player.seek(LENGTH - 300)
+    threading.Event().wait(0.6)
+    assert "end" not in events
+    assert player.get_status() == "Paused"